@@ -0,0 +1,94 @@
+import hashlib
+import TofReader
+
+
+class BatchIndex(object):
+    '''
+    Index of a batch of *.toff files built from their headers and row counts only, so that malformed files, short files
+    and the binning of every file are known before any counts are parsed.
+    '''
+
+    def __init__(self, infiles):
+        '''
+        Constructor
+        :param infiles: *.toff files to index
+        '''
+        self.entries = {}
+        self.problems = {}
+        self.rows = {}
+        for infile in infiles:
+            self._scan(infile)
+
+    def _scan(self, infile):
+        try:
+            tof, numRows, numColumns = TofReader.TofReader(infile).scan()
+        except Exception as e:
+            self.problems[infile] = type(e).__name__ + ": " + str(e)
+            return
+
+        if len(tof) == 0:
+            self.problems[infile] = "Malformed toff file " + infile + ": the header has no TOF values"
+        elif numColumns != len(tof) + 2:
+            self.problems[infile] = "Malformed toff file " + infile + ": the header has " + str(len(tof) + 2) + \
+                                    " columns but the first row has " + str(numColumns)
+        else:
+            self.rows[infile] = numRows
+            self.entries[infile] = {"rows": numRows, "bins": len(tof), "tofMin": tof.min(), "tofMax": tof.max(),
+                                    "signature": hashlib.sha1(tof.tostring()).hexdigest()}
+
+    def validate(self, validIDs):
+        '''
+        Checks that every file has a row for each valid detector ID.
+        :param validIDs: Valid detector IDs, which are also the row indices of the detectors in the files
+        '''
+        maxID = validIDs.max()
+        for infile, entry in self.entries.items():
+            if entry["rows"] <= maxID:
+                self.problems[infile] = "File " + infile + " has " + str(entry["rows"]) + \
+                                        " detector rows but detector ID " + str(maxID) + " is valid"
+                del self.entries[infile]
+
+    def groupBanks(self, runFiles, numBanks):
+        '''
+        Indexes runs stored as one file per bank under the file of their first bank. A run is invalid if it does not
+        have a file for each bank, if any of its files is invalid or if its banks do not all have the same binning.
+        The row counts of every file are kept.
+        :param runFiles: Dictionary of the first file of each run to the files of its banks, None for missing banks
+        :param numBanks: Number of banks every run must have
+        '''
+        for infile, bankFiles in runFiles.items():
+            if len(bankFiles) != numBanks or None in bankFiles:
+                for f in bankFiles:
+                    self.entries.pop(f, None)
+                    self.problems.pop(f, None)
+                self.problems[infile] = "Run " + infile + " has files for banks " + \
+                                        ", ".join(str(b) for b, f in enumerate(bankFiles) if f is not None) + \
+                                        " but the detector map has " + str(numBanks) + " bank(s)"
+                continue
+            if len(bankFiles) == 1:
+                continue
+            problems = [self.problems.pop(f) for f in bankFiles if f in self.problems]
+            entries = [self.entries.pop(f) for f in bankFiles if f in self.entries]
+            if len(problems) == 0 and len(set(entry["signature"] for entry in entries)) > 1:
+                problems.append("The banks of run " + infile + " do not all have the same binning")
+            if len(problems) > 0:
+                self.problems[infile] = "\n".join(problems)
+            else:
+                self.entries[infile] = entries[0]
+
+    def numRows(self, infile):
+        return self.rows[infile]
+
+    def scheduled(self):
+        '''
+        :return: The valid files grouped by identical binning, groups in order of their first file.
+        '''
+        groups = {}
+        for infile in sorted(self.entries):
+            groups.setdefault(self.entries[infile]["signature"], []).append(infile)
+        return [infile for group in sorted(groups.values()) for infile in group]
+
+    def summary(self):
+        signatures = set(entry["signature"] for entry in self.entries.values())
+        return "Indexed " + str(len(self.entries) + len(self.problems)) + " files: " + str(len(self.entries)) + \
+               " valid in " + str(len(signatures)) + " binning group(s), " + str(len(self.problems)) + " invalid"
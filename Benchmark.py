@@ -0,0 +1,215 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import numpy
+import ConvertLOKIRuns
+import ExtractGeometry
+import GenerateIDF
+
+
+class SyntheticData(object):
+    '''
+    Writes synthetic coordinate files and *.toff runs. The layout is a trapezoid of pads split into components, each
+    with its own pad height and number of pads per row, in the format of coordinate.txt including dummy "Z" entries.
+    '''
+
+    def __init__(self, folder, components=5, rowsPerComponent=16, padsPerRow=24, dummies=64, seed=0):
+        '''
+        Constructor
+        :param folder: Folder in which the synthetic files are written
+        :param components: Number of components, successive components have one more pad per row
+        :param rowsPerComponent: Number of pad rows in each component
+        :param padsPerRow: Number of pads in each row of the first component
+        :param dummies: Number of dummy entries interleaved with the pads
+        :param seed: Seed for the counts in the runs
+        '''
+        self.folder = folder
+        self.components = components
+        self.rowsPerComponent = rowsPerComponent
+        self.padsPerRow = padsPerRow
+        self.dummies = dummies
+        self.random = numpy.random.RandomState(seed)
+        self.numIDs = 0
+
+    def _pads(self):
+        '''
+        :return: Pad centres and corner offsets, corners are ordered bottom left, bottom right, top right, top left.
+        '''
+        centres = []
+        corners = []
+        y = 200.0
+        for c in xrange(self.components):
+            height = 4.0 + 2.0 * (c % 2)
+            numPads = self.padsPerRow + c
+            for r in xrange(self.rowsPerComponent):
+                # pads widen linearly with y so each row is a trapezoid
+                bottom = (numpy.arange(numPads + 1) - numPads / 2.0) * (5.0 + 0.01 * y)
+                top = (numpy.arange(numPads + 1) - numPads / 2.0) * (5.0 + 0.01 * (y + height))
+                for p in xrange(numPads):
+                    cx = (bottom[p] + bottom[p + 1] + top[p] + top[p + 1]) / 4.0
+                    cy = y + height / 2.0
+                    centres.append((cx, cy))
+                    corners.append((bottom[p] - cx, -height / 2.0, bottom[p + 1] - cx, -height / 2.0,
+                                    top[p + 1] - cx, height / 2.0, top[p] - cx, height / 2.0))
+                y += height
+            y += 1.0
+        return centres, corners
+
+    def writeCoordinates(self, name="coordinate.txt"):
+        '''
+        :return: Path of the coordinate file
+        '''
+        centres, corners = self._pads()
+        numEntries = len(centres) + self.dummies
+        dummyIDs = set(numpy.linspace(0, numEntries - 1, self.dummies).astype(int)) if self.dummies > 0 else set()
+        while len(dummyIDs) < self.dummies:
+            dummyIDs.add(len(dummyIDs))
+
+        lines = ["ID\tNAME\tX\tY\tXR\tmmX\tmmY\tX1\tY1\tX2\tY2\tX3\tY3\tX4\tY4\n"]
+        pad = 0
+        for id in xrange(numEntries):
+            if id in dummyIDs:
+                lines.append(str(id) + "\tZ1\t-1\t-1\t0" + "\t1" * 10 + "\n")
+            else:
+                values = (centres[pad][0], centres[pad][1]) + corners[pad]
+                lines.append(str(id) + "\tA" + str(pad) + "\t0\t0\t0\t" + "\t".join("%.6f" % v for v in values) + "\n")
+                pad += 1
+        self.numIDs = numEntries
+
+        path = os.path.join(self.folder, name)
+        with open(path, "w") as f:
+            f.write("".join(lines))
+        return path
+
+    def writeRuns(self, numFiles, numBins, banks=1, subfolder="runs"):
+        '''
+        Writes runs with a row for every ID of the last coordinate file written and one for the monitor, as one file
+        per bank if there is more than one bank.
+        :return: Folder which contains the runs
+        '''
+        folder = os.path.join(self.folder, subfolder)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        header = "ID\t" + "\t".join(str(t) for t in 1000 + 10 * numpy.arange(numBins)) + "\t\n"
+        for i in xrange(numFiles):
+            for bank in xrange(banks):
+                counts = self.random.poisson(2.0, (self.numIDs + 1, numBins))
+                name = "run" + str(i) + ("_bank" + str(bank) if banks > 1 else "") + ".toff"
+                with open(os.path.join(folder, name), "w") as f:
+                    f.write(header)
+                    for id, row in enumerate(counts):
+                        f.write(str(id) + "\t" + "\t".join(map(str, row)) + "\t\n")
+        return folder
+
+
+class Benchmark(object):
+    '''
+    Times geometry extraction, IDF generation and the run loading path of ConvertLokiRuns on synthetic data. None of
+    these stages need Mantid.
+    '''
+
+    def __init__(self, data, banks=1, files=4, bins=1000, repeats=3):
+        self.data = data
+        self.banks = banks
+        self.files = files
+        self.bins = bins
+        self.repeats = repeats
+
+    def _time(self, function):
+        '''
+        Runs function repeatedly with stdout discarded.
+        :return: Wall time of each repeat in seconds
+        '''
+        times = []
+        stdout = sys.stdout
+        with open(os.devnull, "w") as devnull:
+            for i in xrange(self.repeats):
+                sys.stdout = devnull
+                try:
+                    start = time.time()
+                    function()
+                    times.append(time.time() - start)
+                finally:
+                    sys.stdout = stdout
+        return times
+
+    def _result(self, stage, times, **extra):
+        result = {"stage": stage, "seconds": times, "min": min(times), "mean": sum(times) / len(times)}
+        result.update(extra)
+        return result
+
+    def run(self):
+        '''
+        :return: Dictionary of parameters and the timing of each stage
+        '''
+        coordinateFile = self.data.writeCoordinates()
+        runFolder = self.data.writeRuns(self.files, self.bins, self.banks)
+        results = []
+
+        extractor = ExtractGeometry.GeometryExtractor(coordinateFile)
+        results.append(self._result("GeometryExtractor.extract", self._time(extractor.extract),
+                                    detectors=len(extractor.detIDs), components=extractor.getNumComponents()))
+
+        # the generator writes the IDF and map into the working directory
+        cwd = os.getcwd()
+        os.chdir(self.data.folder)
+        try:
+            results.append(self._result("LOKIGenerator.generate", self._time(
+                lambda: GenerateIDF.LOKIGenerator(coordinateFile, self.banks).generate()), banks=self.banks))
+        finally:
+            os.chdir(cwd)
+
+        newConverter = lambda: ConvertLOKIRuns.ConvertLokiRuns(runFolder, coordinateFile, "",
+                                                               os.path.join(self.data.folder, "LOKI_map.csv"),
+                                                               cacheFolder=None)
+        results.append(self._result("ConvertLokiRuns._loadRunInvariants",
+                                    self._time(lambda: newConverter()._loadRunInvariants())))
+        converter = newConverter()
+        converter._loadRunInvariants()
+        runs = converter._listRuns()
+        times = self._time(lambda: [converter._loadTofData(run) for run in runs])
+        spectra = len(converter.spectrumOrder) * len(runs)
+        runBytes = sum(os.path.getsize(f) for run in runs for f in converter._sources(run))
+        results.append(self._result("ConvertLokiRuns._loadTofData", times, files=len(runs), banks=self.banks,
+                                    bins=self.bins, spectraPerSecond=spectra / min(times),
+                                    megabytesPerSecond=runBytes / min(times) / 1e6))
+
+        return {"parameters": {"components": self.data.components, "rowsPerComponent": self.data.rowsPerComponent,
+                               "padsPerRow": self.data.padsPerRow, "dummies": self.data.dummies, "banks": self.banks,
+                               "files": self.files, "bins": self.bins, "repeats": self.repeats},
+                "environment": {"python": platform.python_version(), "numpy": numpy.__version__,
+                                "machine": platform.machine()},
+                "results": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark geometry extraction, IDF generation and run loading on '
+                                                 'synthetic LOKI data.')
+    parser.add_argument('--Components', default=5, type=int, help="Number of detector components. Defaults to 5.")
+    parser.add_argument('--Rows', default=16, type=int, help="Number of pad rows in each component. Defaults to 16.")
+    parser.add_argument('--Pads', default=24, type=int, help="Number of pads in each row of the first component. Defaults to 24.")
+    parser.add_argument('--Dummies', default=64, type=int, help="Number of dummy Z entries in the coordinate file. Defaults to 64.")
+    parser.add_argument('-n', '--NumberOfBanks', default=1, type=int, help="Number of banks in the generated IDF. Defaults to 1.")
+    parser.add_argument('--Files', default=4, type=int, help="Number of synthetic runs. Defaults to 4.")
+    parser.add_argument('--Bins', default=1000, type=int, help="Number of TOF bins in each run. Defaults to 1000.")
+    parser.add_argument('--Repeats', default=3, type=int, help="Number of times each stage is timed. Defaults to 3.")
+    parser.add_argument('-o', '--Output', default="", help="Optional JSON file for the results. Defaults to stdout.")
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix="loki_benchmark_")
+    try:
+        data = SyntheticData(folder, args.Components, args.Rows, args.Pads, args.Dummies)
+        report = Benchmark(data, args.NumberOfBanks, args.Files, args.Bins, args.Repeats).run()
+    finally:
+        shutil.rmtree(folder)
+
+    if args.Output == "":
+        print json.dumps(report, indent=1, sort_keys=True)
+    else:
+        with open(args.Output, "w") as f:
+            json.dump(report, f, indent=1, sort_keys=True)
@@ -0,0 +1,289 @@
+import numpy
+
+
+class SparseCounts(object):
+    '''
+    Counts held in compressed sparse row form: the non-zero counts of row i are data[indptr[i]:indptr[i + 1]] and lie
+    in the columns indices[indptr[i]:indptr[i + 1]].
+    '''
+
+    def __init__(self, indptr, indices, data, numColumns):
+        '''
+        Constructor
+        :param indptr: Start of each row in indices and data, followed by the number of non-zero counts
+        :param indices: Column of each non-zero count
+        :param data: Non-zero counts
+        :param numColumns: Number of columns of the dense counts
+        '''
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.shape = (len(indptr) - 1, numColumns)
+
+    def arrays(self):
+        '''
+        :return: Dictionary of the arrays which hold the counts, e.g. to save them
+        '''
+        return {"indptr": self.indptr, "indices": self.indices, "data": self.data,
+                "numColumns": numpy.array(self.shape[1])}
+
+    def take(self, rows):
+        '''
+        :param rows: Index of the row to take for each row of the result
+        :return: SparseCounts of the given rows
+        '''
+        starts = self.indptr[rows]
+        lengths = self.indptr[numpy.asarray(rows) + 1] - starts
+        indptr = numpy.zeros(len(lengths) + 1, dtype=numpy.int64)
+        numpy.cumsum(lengths, out=indptr[1:])
+        # element k of output row r comes from position starts[r] + k - indptr[r]
+        positions = numpy.arange(indptr[-1]) - numpy.repeat(indptr[:-1] - starts, lengths)
+        return SparseCounts(indptr, self.indices[positions], self.data[positions], self.shape[1])
+
+    def _rows(self, start, stop):
+        return numpy.repeat(numpy.arange(stop - start), numpy.diff(self.indptr[start:stop + 1]))
+
+    def toDense(self, start=0, stop=None, dtype=float, out=None):
+        '''
+        :param start: First row to expand
+        :param stop: Row after the last row to expand, defaults to the number of rows
+        :param dtype: Type of the dense counts
+        :param out: Optional array to expand into instead of a new one
+        :return: Dense counts of the rows
+        '''
+        if stop is None:
+            stop = self.shape[0]
+        if out is None:
+            dense = numpy.zeros((stop - start, self.shape[1]), dtype=dtype)
+        else:
+            dense = out
+            dense[...] = 0
+        first, last = self.indptr[start], self.indptr[stop]
+        dense[self._rows(start, stop), self.indices[first:last]] = self.data[first:last]
+        return dense
+
+    def addTo(self, total):
+        '''
+        Adds the counts to a dense array in place.
+        :param total: Dense array with the shape of the counts
+        '''
+        # each row and column appears once so there are no repeated indices to accumulate
+        total[self._rows(0, self.shape[0]), self.indices] += self.data
+
+
+def _isWhole(counts):
+    '''
+    :return: Whether the counts are all whole numbers which are not negative
+    '''
+    return counts.size == 0 or (counts.min() >= 0 and numpy.array_equal(numpy.floor(counts), counts))
+
+
+def _sparseBlock(counts, nonZero, dtype):
+    '''
+    :param nonZero: Number of non-zero counts, so the arrays are allocated at their exact size
+    :return: SparseCounts of whole number counts with the data in the given type
+    '''
+    indptr = numpy.zeros(counts.shape[0] + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.count_nonzero(counts, axis=1), out=indptr[1:])
+    nonZeroMask = counts != 0
+    indices = numpy.empty(nonZero, dtype=numpy.int32)
+    indices[...] = numpy.nonzero(nonZeroMask)[1]
+    return SparseCounts(indptr, indices, counts[nonZeroMask].astype(dtype), counts.shape[1])
+
+
+class CompactBuilder(object):
+    '''
+    Builds the compact counts of a run from blocks of rows as they are parsed, so the float counts of the whole run are
+    only held if they turn out not to be whole numbers. Each block is checked and kept in its own narrowest form, the
+    layout of the run is chosen from the totals once every block has been added.
+    '''
+
+    def __init__(self, numColumns, numRows=None, maxDensity=0.25):
+        '''
+        Constructor
+        :param numColumns: Number of columns of the counts
+        :param numRows: Optional number of rows of the run, so the float counts are allocated at their exact size if
+        they are needed
+        :param maxDensity: Largest fraction of non-zero counts which are stored as SparseCounts
+        '''
+        self.numColumns = numColumns
+        self.numRows = numRows
+        self.maxDensity = maxDensity
+        self.blocks = []
+        self.rows = 0
+        self.nonZero = 0
+        self.maxValue = 0
+        self.dense = None
+
+    def _toFloats(self):
+        '''
+        Gives up on compacting, the blocks so far are expanded into float counts which the remaining blocks are added to.
+        '''
+        if self.numRows is None:
+            self.dense = [expand(block) for block in self.blocks]
+        else:
+            self.dense = numpy.empty((self.numRows, self.numColumns))
+            start = 0
+            for block in self.blocks:
+                self._addFloats(block, start)
+                start += block.shape[0]
+        self.blocks = None
+
+    def _addFloats(self, counts, start):
+        if isinstance(self.dense, list):
+            self.dense.append(numpy.array(counts, dtype=float))
+        elif start + counts.shape[0] > self.numRows:
+            raise ValueError("More than the " + str(self.numRows) + " rows expected")
+        elif isinstance(counts, SparseCounts):
+            counts.toDense(out=self.dense[start:start + counts.shape[0]])
+        else:
+            self.dense[start:start + counts.shape[0]] = counts
+
+    def add(self, counts):
+        '''
+        :param counts: Dense float counts of the next block of rows
+        '''
+        if self.dense is None and not _isWhole(counts):
+            self._toFloats()
+        if self.dense is not None:
+            self._addFloats(counts, self.rows)
+        elif counts.size > 0:
+            # count the non-zero counts before choosing a layout so indices are only made for sparse blocks
+            nonZero = numpy.count_nonzero(counts)
+            maxValue = int(counts.max())
+            dtype = numpy.min_scalar_type(maxValue)
+            if nonZero <= self.maxDensity * counts.size:
+                self.blocks.append(_sparseBlock(counts, nonZero, dtype))
+            else:
+                self.blocks.append(counts.astype(dtype))
+            self.nonZero += nonZero
+            self.maxValue = max(self.maxValue, maxValue)
+        self.rows += counts.shape[0]
+
+    def result(self):
+        '''
+        :return: SparseCounts if the counts are whole numbers of which at most maxDensity are non-zero, the counts in the
+        narrowest unsigned integer type if they are whole numbers otherwise, or dense float counts.
+        '''
+        if self.dense is not None:
+            if isinstance(self.dense, list):
+                return numpy.concatenate([numpy.zeros((0, self.numColumns))] + self.dense)
+            if self.rows != self.numRows:
+                raise ValueError("Expected " + str(self.numRows) + " rows but " + str(self.rows) + " were added")
+            return self.dense
+
+        dtype = numpy.min_scalar_type(self.maxValue)
+        if self.nonZero <= self.maxDensity * self.rows * self.numColumns:
+            blocks = [block if isinstance(block, SparseCounts) else _sparseBlock(block, numpy.count_nonzero(block), dtype)
+                      for block in self.blocks]
+            indptr = numpy.zeros(self.rows + 1, dtype=numpy.int64)
+            start = 0
+            for block in blocks:
+                indptr[start + 1:start + block.shape[0] + 1] = block.indptr[1:] + indptr[start]
+                start += block.shape[0]
+            return SparseCounts(indptr, numpy.concatenate([numpy.zeros(0, dtype=numpy.int32)] +
+                                                          [block.indices for block in blocks]),
+                                numpy.concatenate([numpy.zeros(0, dtype=dtype)] +
+                                                  [block.data.astype(dtype) for block in blocks]), self.numColumns)
+
+        counts = numpy.empty((self.rows, self.numColumns), dtype=dtype)
+        start = 0
+        for block in self.blocks:
+            if isinstance(block, SparseCounts):
+                block.toDense(out=counts[start:start + block.shape[0]])
+            else:
+                counts[start:start + block.shape[0]] = block
+            start += block.shape[0]
+        return counts
+
+
+def compact(counts, maxDensity=0.25, blockRows=4096):
+    '''
+    Finds the most compact representation of counts which are whole numbers, working through the counts a block of rows
+    at a time so that the temporaries are the size of a block.
+    :param counts: Dense counts
+    :param maxDensity: Largest fraction of non-zero counts which are stored as SparseCounts
+    :param blockRows: Number of rows in each block
+    :return: SparseCounts if the counts are whole numbers of which at most maxDensity are non-zero, the counts in the
+    narrowest unsigned integer type if they are whole numbers otherwise, or the counts unchanged.
+    '''
+    if counts.size == 0:
+        return counts
+    builder = CompactBuilder(counts.shape[1], maxDensity=maxDensity)
+    for start in xrange(0, counts.shape[0], blockRows):
+        block = counts[start:start + blockRows]
+        if not _isWhole(block):
+            return counts
+        builder.add(block)
+    return builder.result()
+
+
+def fromArrays(arrays):
+    '''
+    :param arrays: Dictionary of arrays, either as returned by SparseCounts.arrays or dense counts under "counts"
+    :return: The counts they hold
+    '''
+    if "counts" in arrays:
+        return arrays["counts"]
+    return SparseCounts(arrays["indptr"], arrays["indices"], arrays["data"], int(arrays["numColumns"]))
+
+
+def toArrays(counts):
+    if isinstance(counts, SparseCounts):
+        return counts.arrays()
+    return {"counts": counts}
+
+
+def takeRows(counts, rows):
+    '''
+    :param counts: Dense or sparse counts
+    :param rows: Index of the row to take for each row of the result
+    :return: Counts of the given rows in the same representation
+    '''
+    if isinstance(counts, SparseCounts):
+        return counts.take(rows)
+    return counts[rows]
+
+
+def takeRowsInto(out, counts, rows):
+    '''
+    Gathers rows straight into part of a larger array.
+    :param out: Dense array with a row for each of the rows
+    :param counts: Dense or sparse counts
+    :param rows: Index of the row to take for each row of out
+    '''
+    if isinstance(counts, SparseCounts):
+        counts.take(rows).toDense(out=out)
+    elif counts.dtype == out.dtype:
+        numpy.take(counts, rows, axis=0, out=out)
+    else:
+        out[...] = counts[rows]
+
+
+def dtypeOf(counts):
+    if isinstance(counts, SparseCounts):
+        return counts.data.dtype
+    return counts.dtype
+
+
+def expand(counts, start=0, stop=None):
+    '''
+    :param counts: Dense or sparse counts
+    :param start: First row to expand
+    :param stop: Row after the last row to expand, defaults to the number of rows
+    :return: Float counts of the rows, the counts themselves if they are already dense floats
+    '''
+    if isinstance(counts, SparseCounts):
+        return counts.toDense(start, stop)
+    return numpy.asarray(counts[start:stop], dtype=float)
+
+
+def addTo(total, counts):
+    '''
+    :param total: Dense float array which the counts are added to in place
+    :param counts: Dense or sparse counts
+    '''
+    if isinstance(counts, SparseCounts):
+        counts.addTo(total)
+    else:
+        total += counts
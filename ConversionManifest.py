@@ -0,0 +1,74 @@
+import json
+import os
+
+
+class ConversionManifest(object):
+    '''
+    Record of the runs converted into an output folder. For each *.toff file it holds the size, modification time and
+    content hash of the source together with the hashes of the IDF, detector map and coordinate file used, so that only
+    new or changed runs are converted again.
+    '''
+
+    def __init__(self, outputFolder, name="conversion_manifest.json"):
+        '''
+        Constructor
+        :param outputFolder: Folder which contains the converted nexus files and the manifest
+        :param name: File name of the manifest
+        '''
+        self.filename = os.path.join(outputFolder, name)
+        self.entries = {}
+        if os.path.exists(self.filename):
+            with open(self.filename, "r") as f:
+                self.entries = json.load(f)
+
+    def _stat(self, sources):
+        '''
+        :param sources: Files a run is read from
+        :return: Their total size and latest modification time
+        '''
+        stats = [os.stat(source) for source in sources]
+        return sum(stat.st_size for stat in stats), max(stat.st_mtime for stat in stats)
+
+    def isUpToDate(self, infile, outfile, versions, hasher, sources=None):
+        '''
+        A run is up to date if its output exists and neither the source nor any of the versions have changed. The
+        source is only hashed if its size or modification time differ from the manifest.
+        :param infile: Source *.toff file
+        :param outfile: Converted nexus file
+        :param versions: Dictionary of the hashes of the files the conversion depends on
+        :param hasher: Function returning the content hash of a run
+        :param sources: Optional files the run is read from, e.g. one per bank. Defaults to the infile.
+        :return: True if the run does not need converting
+        '''
+        entry = self.entries.get(os.path.basename(infile))
+        if entry is None or not os.path.exists(outfile) or entry["versions"] != versions:
+            return False
+
+        size, mtime = self._stat(sources or [infile])
+        if entry["size"] == size and entry["mtime"] == mtime:
+            return True
+        if entry["size"] != size or entry["sha1"] != hasher(infile):
+            return False
+        # touched but unchanged
+        entry["mtime"] = mtime
+        return True
+
+    def record(self, infile, outfile, versions, sha1, sources=None):
+        '''
+        Records a converted run and writes the manifest so that progress survives an interrupted batch.
+        :param infile: Source *.toff file
+        :param outfile: Converted nexus file
+        :param versions: Dictionary of the hashes of the files the conversion depends on
+        :param sha1: Content hash of the source
+        :param sources: Optional files the run is read from, e.g. one per bank. Defaults to the infile.
+        '''
+        size, mtime = self._stat(sources or [infile])
+        self.entries[os.path.basename(infile)] = {"size": size, "mtime": mtime, "sha1": sha1,
+                                                  "versions": versions, "output": os.path.basename(outfile)}
+        self.save()
+
+    def save(self):
+        tmpName = self.filename + ".tmp"
+        with open(tmpName, "w") as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.rename(tmpName, self.filename)
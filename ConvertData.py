@@ -1,7 +1,11 @@
 import argparse
 import GenerateIDF
 import ConvertLOKIRuns
+import FileCache
 import os
+import Profiling
+import Rebinning
+import RegionIntegration
 
 parser = argparse.ArgumentParser(description='Convert LOKI Data from *.toff files to *.nexus.')
 parser.add_argument('-d', '--DataLocation',
@@ -9,15 +13,56 @@ parser.add_argument('-d', '--DataLocation',
 parser.add_argument('-c', '--CoordinateFile', help="Location of coordinate.txt file which contains engineering coordinates for detector pads.")
 parser.add_argument('-n', "--NumberOfBanks", nargs='?', const=1, type=int, help="The desired number of LOKI panels. Defaults to 1.")
 parser.add_argument('-o', '--OutputFolder', nargs='?', const="", help="Optional location for converted nexus files. Defaults to the DataLocation")
+parser.add_argument('--CacheFolder', default=FileCache.defaultFolder, help="Optional location for cached coordinate and map tables. Defaults to .loki_cache in the working directory, shared with the geometry cache")
+parser.add_argument('--GeometryCacheFolder', default=FileCache.defaultFolder, help="Location of the cached detector geometry extracted from the CoordinateFile. Defaults to .loki_cache in the working directory")
+parser.add_argument('--RebuildGeometryCache', action='store_true', help="Extract the detector geometry from the CoordinateFile even if it is cached.")
+parser.add_argument('-w', '--Workers', default=1, type=int, help="Number of processes used to parse the runs. Defaults to 1.")
+parser.add_argument('-p', '--Prefetch', default=0, type=int, help="Number of runs read and parsed ahead of the run being written, by a reader thread with one worker or by the pool with more. Defaults to 0, which reads each run when it is needed with one worker and two runs per worker with more.")
+parser.add_argument('-k', '--KeepWorkspaces', action='store_true', help="Keep the converted workspaces in the ADS instead of deleting each one once it is saved.")
+parser.add_argument('-f', '--Force', action='store_true', help="Convert every run, including those the manifest in the OutputFolder records as converted. With --Watch each run is converted once when it is first seen and then only if it changes.")
+parser.add_argument('--Watch', nargs='?', const=10.0, type=float, help="Keep polling the DataLocation every WATCH seconds (default 10) and convert runs as they are written.")
+parser.add_argument('-b', '--Backend', default="mantid", choices=["mantid", "h5py"], help="Write the nexus files through Mantid or directly with h5py, which does not need mantidpython. Defaults to mantid.")
+parser.add_argument('--Compression', default=4, type=int, help="gzip level of the data sets written by the h5py backend, 0 disables compression. Defaults to 4.")
+parser.add_argument('--ChunkSpectra', default=64, type=int, help="Number of spectra in each chunk of the data sets written by the h5py backend. Defaults to 64.")
+parser.add_argument('--RunCache', action='store_true', help="Keep each parsed run in the CacheFolder as memory-mappable arrays so reconverting it, e.g. with a new IDF or map, does not parse the toff file again.")
+parser.add_argument('--DenseCounts', action='store_true', help="Hold the counts of every run as dense floats instead of narrow integers, or sparse rows for mostly empty runs, until they are written.")
+parser.add_argument('--NormaliseSolidAngle', action='store_true', help="Divide the counts of each detector by its solid angle from the LOKI_pixels.npy table written with the IDF.")
+parser.add_argument('--Rebin', type=Rebinning.parseParams, help="Optional Mantid style rebin parameters in microseconds, the units of the TOF axis of the outputs, x1,dx1,x2 with further dx,x pairs allowed and a negative dx for logarithmic bins. The counts are rebinned, conserving counts, before they are written.")
+parser.add_argument('--Sum', action='store_true', help="Sum the runs into one nexus file per group instead of converting each run.")
+parser.add_argument('--GroupPattern', help="Optional regular expression which groups runs by name for --Sum. Runs are grouped by its first group, or the whole match, and runs which do not match are left out. Defaults to a single group.")
+parser.add_argument('--Regions', help="Optional JSON file of detector regions. The counts of each run are integrated over each region into <run>_regions.csv instead of converting the run.")
+parser.add_argument('--Profile', help="Optional JSON file for a report of the time, memory, bytes and throughput of each stage and file. The memory of a stage is the change in resident memory over it and how far it raised the peak of the process.")
+parser.add_argument('--CProfileStage', help="Name of a stage, e.g. parseToff or SaveNexus, to also run under cProfile. The statistics, merged over the worker processes, are dumped next to the Profile report.")
 
 args = parser.parse_args()
 
-generator = GenerateIDF.LOKIGenerator(args.CoordinateFile, args.NumberOfBanks)
+if args.Profile is not None:
+    Profiling.profiler.enable(args.CProfileStage)
+
+generator = GenerateIDF.LOKIGenerator(args.CoordinateFile, args.NumberOfBanks, args.GeometryCacheFolder,
+                                      args.RebuildGeometryCache)
 generator.generate()
 
 mainPath = os.getcwd()
 converter = ConvertLOKIRuns.ConvertLokiRuns(args.DataLocation, args.CoordinateFile,
                                             os.path.join(mainPath, "LOKI_BANDGEM_definition.xml"),
-                                            os.path.join(mainPath, "LOKI_map.csv"), args.OutputFolder)
+                                            os.path.join(mainPath, "LOKI_map.csv"), args.OutputFolder,
+                                            args.CacheFolder, args.Workers, args.KeepWorkspaces, args.Force,
+                                            args.Backend, args.Compression, args.ChunkSpectra, args.RunCache,
+                                            args.Rebin, not args.DenseCounts, args.Prefetch,
+                                            os.path.join(mainPath, "LOKI_pixels.npy") if args.NormaliseSolidAngle else "")
 
-converter.convert()
+try:
+    if args.Regions is not None:
+        converter.integrateRegions(RegionIntegration.RegionIntegrator(args.Regions, args.CoordinateFile,
+                                                                      os.path.join(mainPath, "LOKI_map.csv"),
+                                                                      args.GeometryCacheFolder))
+    elif args.Sum:
+        converter.sumRuns(args.GroupPattern)
+    elif args.Watch is None:
+        converter.convert()
+    else:
+        converter.watch(args.Watch)
+finally:
+    if args.Profile is not None:
+        Profiling.profiler.writeReport(args.Profile)
@@ -1,32 +1,125 @@
+import collections
 import csv
+import multiprocessing
+import multiprocessing.pool
 import numpy
 import os
-from mantid.simpleapi import CreateWorkspace, LoadInstrument, SaveNexus
+import Queue
+import re
+import threading
+import time
+import BatchIndex
+import CompactCounts
+import ConversionManifest
+import FileCache
+import GenerateIDF
+import NexusWriters
+import Profiling
+import Rebinning
+import TofReader
+
+_workerConverter = None
+
+
+def _initWorker(converter):
+    '''
+    Gives each pool worker its own copy of the converter and its run-invariant tables.
+    '''
+    global _workerConverter
+    _workerConverter = converter
+    # drop the records and statistics inherited from the parent so that only the worker's own are passed back
+    Profiling.profiler.popRecords()
+    Profiling.profiler.popStats()
+
+
+def _loadInWorker(infile):
+    result = _workerConverter._tryLoadTofData(infile)
+    return result, Profiling.profiler.popRecords(), Profiling.profiler.popStats()
+
 
 class ConvertLokiRuns(object):
     '''
     THIS FILE IS INTENDED TO BE RUN FROM THE MANTID SCRIPT WINDOW
     Converts *.toff files to Nexus files by loading data, creating the workspace
-    and loading the appropriate instrument.
+    and loading the appropriate instrument. With the h5py backend the processed
+    Nexus files are written directly and Mantid is not needed.
     '''
 
-    def __init__(self, dataFolder, coordinateFile, IDF, detectorMapFile="", outputFolder=""):
+    def __init__(self, dataFolder, coordinateFile, IDF, detectorMapFile="", outputFolder="", cacheFolder="",
+                 workers=1, keepWorkspaces=False, force=False, backend="mantid", compression=4, chunkSpectra=64,
+                 runCache=False, rebinParams=None, compactCounts=True,
+                 prefetch=0, pixelTableFile=""):
         '''
         Constructor
-        :param dataFolder: Folder which contains LOKI runs as *.toff files
+        :param dataFolder: Folder which contains LOKI runs as *.toff files, or as one <run>_bank<N>.toff file per bank
+        with N counting from 0 for detector maps of more than one bank
         :param coordinateFile: File which contains all coordinates with respect to detector IDs
         :param IDF: Instrument definition file which contains instrument geometry.
         :param detectorMapFile: Optional detector map to transform detector IDs in physical space to that of the StructuredDetector if it is used.
+        The map may have several banks, as written by LOKIGenerator, in which case each run has a file for each bank.
+        :param outputFolder: Optional location for converted nexus files. Defaults to the dataFolder.
+        :param cacheFolder: Optional location of the cache for parsed coordinate and map files. Defaults to .loki_cache in
+        the working directory, the default geometry cache of LOKIGenerator, so that every batch shares it. None
+        disables the cache.
+        :param workers: Number of processes used to parse *.toff files. Workspaces are always created and saved in
+        the calling process as Mantid requires.
+        :param keepWorkspaces: If True the converted workspaces are left in the ADS, otherwise each workspace is deleted
+        as soon as it has been saved.
+        :param force: If True every run is converted, otherwise runs recorded in the output folder's manifest as
+        converted with the same source, IDF, map and coordinate files are skipped.
+        :param backend: "mantid" to save through a workspace with SaveNexus or "h5py" to write the file directly.
+        :param compression: gzip level of the data sets written by the h5py backend, 0 disables compression.
+        :param chunkSpectra: Number of spectra in each chunk of the data sets written by the h5py backend.
+        :param runCache: If True each parsed run is kept in the cache as memory-mappable arrays of its TOF axis and raw
+        counts, keyed by the content hash of the *.toff file, so converting it again does not parse the file.
+        :param rebinParams: Optional Mantid style rebin parameters, x1,dx1,x2 with a negative dx for logarithmic bins,
+        in microseconds like the TOF axis. The counts are rebinned before they are written so the outputs hold histograms on these bins.
+        :param compactCounts: If True runs of whole number counts are held in the narrowest unsigned integer type, or
+        as sparse rows if most counts are zero, from parsing until they are written.
+        :param prefetch: Number of runs read and parsed ahead of the run being written. With a single worker the runs
+        are read by a background thread, so reading the next runs overlaps with writing the current one. With more
+        workers it bounds the runs queued on the pool, which defaults to two per worker. 0 reads each run when it is
+        needed.
+        :param pixelTableFile: Optional pixel table written by LOKIGenerator. If given the counts of every detector are
+        divided by its solid angle, the monitor is left as it is.
         '''
         self.folder = dataFolder
         self.coordinateFile = coordinateFile
         self.idf = IDF
         self.detectorMapFile = detectorMapFile
+        self.pixelTableFile = pixelTableFile
         self.ext = ".toff"
-        if outputFolder == "":
+        if not outputFolder:
             self.outFolder = dataFolder
         else:
             self.outFolder = outputFolder
+        if cacheFolder == "":
+            cacheFolder = FileCache.defaultFolder
+        self.cache = FileCache.FileCache(cacheFolder)
+        self.workers = workers
+        self.prefetch = prefetch
+        self.force = force
+        if backend not in ("mantid", "h5py"):
+            raise ValueError("Unknown backend " + backend + ", must be mantid or h5py")
+        self.backend = backend
+        self.keepWorkspaces = keepWorkspaces
+        self.compression = compression
+        self.chunkSpectra = chunkSpectra
+        self.writer = None
+        self.runCache = runCache
+        self.compactCounts = compactCounts
+        self.rebinner = None if rebinParams is None else Rebinning.Rebinner(rebinParams)
+        self.index = None
+        self.manifest = None
+        self.versions = None
+        self.axes = {}
+        self.failures = []
+        self.validIDs = None
+        self.spectrumOrder = None
+        self.numBanks = 1
+        self.runFiles = {}
+        self.runNames = {}
+        self.solidAngles = None
 
     def _loadValidIDs(self):
         '''
@@ -48,90 +141,592 @@ class ConvertLokiRuns(object):
     def _loadDetectorMap(self):
         '''
         If provided, load the detector map from file as a csv with no headers.
-        :return: Detector map
+        :return: Detector map as rows of physical ID and IDF detector ID, empty if there is no map.
         '''
-        if self.detectorMapFile is not "":
+        if self.detectorMapFile != "":
             with open(self.detectorMapFile, "rb") as map:
                 contents = list(csv.reader(map, delimiter=","))
-                contents = numpy.array(contents).astype(int)
-
-                realid = contents[:, 0]
-                id = contents[:, 1]
-                detectormap = {}
-                for rid, id in zip(realid, id):
-                    detectormap[rid] = id
-            return detectormap
+                return numpy.array(contents).astype(int)
         else:
-            return None
+            return numpy.zeros((0, 2), dtype=int)
 
-    def _loadTofData(self, file, validIDs, detMap):
+    def _buildSpectrumOrder(self, validIDs, mapTable):
         '''
-        TOF data is loaded from file and sanitised using the valid detector IDs and detectormap if valid
-        :param file: File which contains tof data
+        Validates the detector map against the valid IDs once so that loading a run is a gather per bank. Each bank of
+        the map must be a bijection from the detector IDs onto its range of spectra, bank b holding spectra b * n to
+        (b + 1) * n - 1 for n detectors as LOKIGenerator assigns idstart, and the monitor, the last valid ID, must be
+        mapped once onto the last spectrum.
         :param validIDs: Valid detector IDs as file contains dummy data
-        :param detMap: Optional map between physical detector ids and IDF detector IDs
-        :return: Tof Data
+        :param mapTable: Rows of physical ID and IDF detector ID, empty if there is no map
+        :return: The physical ID of the row to read for each spectrum, from the file of the spectrum's bank, and the
+        number of banks
         '''
-        with open(file, "rb") as f:
-            contents = list(csv.reader(f, delimiter='\t'))
-            tof = contents[0] # time points as file header
-            del contents[0]
-            del tof[0] # column 0 is the detector id
-            del tof[-1] # the last column contains nothing.
-            tof = numpy.array(tof).astype(float) / 1000.0
-            x = numpy.zeros((len(validIDs), len(tof)))
-            y = numpy.zeros((len(validIDs), len(tof)))
-
-            for i, id in enumerate(validIDs):
-                line = contents[id]
-                del line[0]
-                del line[-1]
-                line = numpy.array(line).astype(float)
-                if detMap == None:
-                    y[i] = line
-                    x[i] = tof
-                else:
-                    y[detMap[id]] = line
-                    x[detMap[id]] = tof
-
-        return x, y
-
-    def _loadRunsAndReturnWorkspaceNames(self):
-        '''
-        Loads tof data from all files in a specified folder into workspaces. The instrument geometry is loaded using
-        the IDF provided.
-        :return: The list of workspace names for saving.
-        '''
-        files = [f for f in os.listdir(self.folder) if self.ext in f]
-
-        self.wsNames = []
-        for file in files:
-            infile = os.path.join(self.folder, file)
-            print "Loading ", infile
-            validIDs = self._loadValidIDs()
-            detMap = self._loadDetectorMap()
-            tofData = self._loadTofData(infile, validIDs, detMap)
-            tofx, tofy = tofData
-
-            wsName = file.replace(self.ext, "")
-            ws = CreateWorkspace(tofx, tofy, NSpec=len(validIDs), OutputWorkspace=wsName)
-            LoadInstrument(ws, True, self.idf)
-            self.wsNames.append(wsName)
-
-    def _saveNexusFiles(self):
-        for wsName in self.wsNames:
-            outfile = os.path.join(self.outFolder, wsName + ".nxs")
-            print "Saving ", outfile
-            SaveNexus(wsName, outfile)
+        if len(mapTable) == 0:
+            return validIDs, 1
+
+        monitor = validIDs[-1]
+        detectors = validIDs[:-1]
+        isMonitor = mapTable[:, 0] == monitor
+        if isMonitor.sum() != 1:
+            raise ValueError("Detector map " + self.detectorMapFile + " does not map the monitor " + str(monitor) +
+                             " exactly once")
+        physicalIds = mapTable[~isMonitor, 0]
+        spectra = mapTable[~isMonitor, 1]
+        banks = GenerateIDF.LOKIGenerator.mapBanks(physicalIds)
+        numBanks = banks.max() + 1 if len(banks) > 0 else 1
+        bankSize = len(detectors)
+
+        if not numpy.array_equal(numpy.sort(physicalIds), numpy.repeat(numpy.sort(detectors), numBanks)):
+            raise ValueError("Detector map " + self.detectorMapFile + " does not map every valid detector ID once in "
+                             "each of its " + str(numBanks) + " bank(s)")
+        if not numpy.array_equal(spectra // bankSize, banks) or \
+                not numpy.array_equal(numpy.sort(spectra), numpy.arange(numBanks * bankSize)):
+            raise ValueError("Detector map " + self.detectorMapFile + " is not a one to one map of the valid detector"
+                             " IDs of each bank onto its " + str(bankSize) + " spectra")
+        if mapTable[isMonitor, 1][0] != numBanks * bankSize:
+            raise ValueError("Detector map " + self.detectorMapFile + " does not map the monitor " +
+                             str(monitor) + " to the last spectrum")
+
+        spectrumOrder = numpy.empty(numBanks * bankSize + 1, dtype=validIDs.dtype)
+        spectrumOrder[spectra] = physicalIds
+        spectrumOrder[-1] = monitor
+        return spectrumOrder, numBanks
+
+    def _loadRunInvariants(self):
+        '''
+        Loads the valid detector IDs and the detector map, which are the same for every run, once per instance. The
+        parsed tables are cached on disk keyed by the content hash of the coordinate and map files.
+        '''
+        if self.validIDs is not None:
+            return
+
+        key = self.cache.hashFiles([self.coordinateFile, self.detectorMapFile])
+        tables = self.cache.load("tables", key)
+        if tables is None:
+            tableFiles = [f for f in (self.coordinateFile, self.detectorMapFile) if f != ""]
+            with Profiling.profiler.stage("parseTables", bytesRead=sum(os.path.getsize(f) for f in tableFiles)):
+                tables = {"validIDs": self._loadValidIDs(), "mapTable": self._loadDetectorMap()}
+            self.cache.save("tables", key, **tables)
+
+        self.validIDs = tables["validIDs"]
+        self.spectrumOrder, self.numBanks = self._buildSpectrumOrder(self.validIDs, tables["mapTable"])
+        self.versions = {"idf": self.cache.hashFiles([self.idf]),
+                         "map": self.cache.hashFiles([self.detectorMapFile]),
+                         "coordinates": self.cache.hashFiles([self.coordinateFile]),
+                         "backend": self.backend}
+        if self.pixelTableFile != "":
+            self.solidAngles = self._loadSolidAngles()
+            self.versions["pixels"] = self.cache.hashFiles([self.pixelTableFile])
+        if self.rebinner is not None:
+            self.versions["rebin"] = ",".join(str(p) for p in self.rebinner.params)
+
+    def _loadSolidAngles(self):
+        '''
+        :return: Solid angle of the detector of each spectrum, 1 for the monitor so that it is not normalised
+        '''
+        table = numpy.load(self.pixelTableFile)
+        numDetectors = len(self.spectrumOrder) - 1
+        if len(table) != numDetectors or not numpy.array_equal(table["id"], numpy.arange(numDetectors)):
+            raise ValueError("Pixel table " + self.pixelTableFile + " does not have a row for each of the " +
+                             str(numDetectors) + " detectors")
+        if (table["solidAngle"] <= 0).any():
+            raise ValueError("Pixel table " + self.pixelTableFile + " has detectors without a solid angle")
+        return numpy.append(table["solidAngle"], 1.0)
+
+    def _createWriter(self):
+        '''
+        The writer is only created when runs are converted so that loading runs does not need the backend.
+        '''
+        if self.writer is not None:
+            return
+        if self.backend == "mantid":
+            self.writer = NexusWriters.MantidWriter(self.idf, self.keepWorkspaces)
+        else:
+            self.writer = NexusWriters.H5pyWriter(self.idf, self.compression, self.chunkSpectra)
+
+    def _parseRun(self, file):
+        '''
+        Parses a run, or memory-maps it from the run cache if it has been parsed before.
+        :param file: File which contains tof data
+        :return: TOF axis and raw counts with one row per physical detector ID, compacted if compactCounts is set
+        '''
+        profiler = Profiling.profiler
+        if self.runCache:
+            key = self.cache.hashFiles([file])
+            with profiler.stage("loadRunCache", file) as record:
+                run = self.cache.loadMapped("run", key)
+                if run is not None:
+                    counts = CompactCounts.fromArrays(run)
+                    record["spectra"], record["bins"] = counts.shape
+                    return run["tof"], counts
+
+        numRows = self.index.numRows(file) if self.index is not None and file in self.index.rows else None
+        with profiler.stage("parseToff", file, bytesRead=os.path.getsize(file)) as record:
+            tof, ids, counts = TofReader.TofReader(file).load(numRows, self.compactCounts)
+            record["spectra"], record["bins"] = counts.shape
+
+        if self.runCache:
+            self.cache.saveMapped("run", key, tof=tof, sha1=numpy.array(key), **CompactCounts.toArrays(counts))
+        return tof, counts
+
+    def _checkRows(self, file, counts):
+        if counts.shape[0] <= self.spectrumOrder.max():
+            raise ValueError("File " + file + " has " + str(counts.shape[0]) + " detector rows but detector ID " +
+                             str(self.spectrumOrder.max()) + " is valid")
+
+    def _bankThreads(self, numFiles):
+        '''
+        Threads only help while there are idle CPUs to run them, on a single CPU they slow parsing down.
+        :param numFiles: Number of bank files of a run
+        :return: Number of threads to parse the bank files of a run in, 1 to parse them in this thread
+        '''
+        return max(1, min(numFiles, multiprocessing.cpu_count() // max(1, self.workers)))
+
+    def _loadBanks(self, file, bankFiles):
+        '''
+        Parses the files of a run with more than one bank, in a thread each while there are CPUs to spare, then gathers
+        the rows of each bank straight into its range of spectra in one preallocated array. The monitor is read from the
+        first bank.
+        :param file: First file of the run
+        :param bankFiles: Files of each bank of the run
+        :return: TOF axis and the counts for each spectrum
+        '''
+        threads = self._bankThreads(len(bankFiles))
+        if threads <= 1:
+            banks = [self._parseRun(bankFile) for bankFile in bankFiles]
+        else:
+            pool = multiprocessing.pool.ThreadPool(threads)
+            try:
+                banks = pool.map(self._parseRun, bankFiles)
+            finally:
+                pool.close()
+                pool.join()
+
+        tof = banks[0][0]
+        for bankFile, (bankTof, counts) in zip(bankFiles, banks):
+            if not numpy.array_equal(bankTof, tof):
+                raise ValueError("The banks of run " + file + " do not all have the same binning")
+            self._checkRows(bankFile, counts)
+
+        bankSize = (len(self.spectrumOrder) - 1) // self.numBanks
+        with Profiling.profiler.stage("remap", file, spectra=len(self.spectrumOrder), bins=len(tof)):
+            total = numpy.empty((len(self.spectrumOrder), len(tof)),
+                                dtype=numpy.result_type(*[CompactCounts.dtypeOf(counts) for bankTof, counts in banks]))
+            for bank, (bankTof, counts) in enumerate(banks):
+                spectra = slice(bank * bankSize, (bank + 1) * bankSize)
+                CompactCounts.takeRowsInto(total[spectra], counts, self.spectrumOrder[spectra])
+            CompactCounts.takeRowsInto(total[-1:], banks[0][1], self.spectrumOrder[-1:])
+        return tof, total
+
+    def _loadTofData(self, file):
+        '''
+        TOF data is loaded from file and sanitised using the valid detector IDs and detectormap if valid. The rows are
+        reordered into spectra with a single gather, or a gather per bank for runs with a file per bank, then rebinned
+        if rebin parameters were given and normalised by solid angle if a pixel table was given.
+        :param file: File which contains tof data, the file of the first bank for runs with a file per bank
+        :return: Tof Data as the TOF axis shared by all spectra, or the bin edges if rebinned, and the counts for each
+        spectrum
+        '''
+        bankFiles = self.runFiles.get(file, [file])
+        if len(bankFiles) != self.numBanks or None in bankFiles:
+            raise ValueError("Run " + file + " does not have a file for each of the " + str(self.numBanks) +
+                             " banks of the detector map")
+        if self.numBanks > 1:
+            tof, counts = self._loadBanks(file, bankFiles)
+        else:
+            tof, counts = self._parseRun(file)
+            self._checkRows(file, counts)
+            with Profiling.profiler.stage("remap", file, spectra=len(self.spectrumOrder), bins=len(tof)):
+                counts = CompactCounts.takeRows(counts, self.spectrumOrder)
+
+        if self.rebinner is not None:
+            with Profiling.profiler.stage("rebin", file, spectra=counts.shape[0], bins=len(tof)):
+                tof, counts = self.rebinner.rebin(tof, CompactCounts.expand(counts))
+        if self.solidAngles is not None:
+            with Profiling.profiler.stage("normalise", file, spectra=counts.shape[0], bins=counts.shape[1]):
+                # the counts are a new array from the gather or rebin so they can be divided in place
+                counts = CompactCounts.expand(counts)
+                counts /= self.solidAngles[:, numpy.newaxis]
+        return tof, counts
+
+    def _tryLoadTofData(self, infile):
+        '''
+        Loads a single run, catching any failure so that it is reported against its own file.
+        :param infile: File which contains tof data
+        :return: The file, its tof data and None on success, or the file, None and the error message on failure.
+        '''
+        try:
+            return infile, self._loadTofData(infile), None
+        except Exception as e:
+            return infile, None, type(e).__name__ + ": " + str(e)
+
+    def _loadRuns(self, infiles):
+        '''
+        Parses the given files, in a process pool if more than one worker is requested or in a reader thread if runs are
+        prefetched. Results are returned in the order of the files whatever order the workers finish in. At most
+        prefetch runs, or two runs per worker, are parsed ahead of the one being saved so memory use does not grow with
+        the number of files.
+        :param infiles: Files which contain tof data
+        :return: Iterator over the results of _tryLoadTofData
+        '''
+        if self.workers <= 1 and self.prefetch > 0:
+            for result in self._prefetchRuns(infiles):
+                yield result
+            return
+        if self.workers <= 1:
+            for infile in infiles:
+                print "Loading ", infile
+                yield self._tryLoadTofData(infile)
+            return
+
+        pool = multiprocessing.Pool(self.workers, _initWorker, (self,))
+        try:
+            pending = collections.deque()
+            for infile in infiles:
+                print "Loading ", infile
+                pending.append(pool.apply_async(_loadInWorker, (infile,)))
+                if len(pending) >= (self.prefetch if self.prefetch > 0 else 2 * self.workers):
+                    yield self._workerResult(pending.popleft())
+            while len(pending) > 0:
+                yield self._workerResult(pending.popleft())
+        finally:
+            pool.close()
+            pool.join()
+
+    def _prefetchRuns(self, infiles):
+        '''
+        Parses the files in a reader thread which blocks once prefetch runs are waiting to be taken.
+        :param infiles: Files which contain tof data
+        :return: Iterator over the results of _tryLoadTofData
+        '''
+        results = Queue.Queue(self.prefetch)
+        stop = threading.Event()
+
+        def read():
+            try:
+                for infile in infiles:
+                    if stop.is_set():
+                        return
+                    print "Loading ", infile
+                    results.put(self._tryLoadTofData(infile))
+            finally:
+                results.put(None)
+
+        reader = threading.Thread(target=read, name="toffReader")
+        reader.daemon = True
+        reader.start()
+        try:
+            while True:
+                result = results.get()
+                if result is None:
+                    return
+                yield result
+        finally:
+            # if the caller stopped early, empty the queue so that a reader blocked on it can finish
+            stop.set()
+            while reader.is_alive():
+                try:
+                    results.get(timeout=0.1)
+                except Queue.Empty:
+                    pass
+
+    def _workerResult(self, asyncResult):
+        '''
+        :return: The result of _tryLoadTofData in a worker, with the worker's profiling records and cProfile statistics
+        added to this process
+        '''
+        result, records, stats = asyncResult.get()
+        Profiling.profiler.addRecords(records)
+        Profiling.profiler.addStats(stats)
+        return result
+
+    def _reportFailure(self, infile, message):
+        print "Failed to convert " + infile + ": " + message
+        self.failures.append((infile, message))
+
+    def _runName(self, infile):
+        return self.runNames.get(infile, os.path.basename(infile).replace(self.ext, ""))
+
+    def _outputFile(self, infile):
+        return os.path.join(self.outFolder, self._runName(infile) + ".nxs")
+
+    def _sources(self, infile):
+        return [f for f in self.runFiles.get(infile, [infile]) if f is not None]
+
+    def _hashRun(self, infile):
+        return self.cache.hashFiles(self._sources(infile))
+
+    def _listRuns(self):
+        '''
+        Lists the runs in the data folder. With a detector map of more than one bank, files named <run>_bank<N>.toff
+        are the banks of one run, which is listed as the file of its first bank. The files of the banks of each run are
+        kept in runFiles, None for missing banks. With a single bank every file is a run whatever its name.
+        :return: Sorted runs
+        '''
+        banked = {}
+        runs = []
+        for name in os.listdir(self.folder):
+            if self.ext not in name:
+                continue
+            match = re.match(r"(.*)_bank(\d+)" + re.escape(self.ext) + "$", name) if self.numBanks > 1 else None
+            if match is None:
+                runs.append(os.path.join(self.folder, name))
+            else:
+                banked.setdefault(match.group(1), {})[int(match.group(2))] = os.path.join(self.folder, name)
+
+        for runName, files in banked.items():
+            infile = files[min(files)]
+            self.runFiles[infile] = [files.get(bank) for bank in xrange(max(files) + 1)]
+            self.runNames[infile] = runName
+            runs.append(infile)
+        return sorted(runs)
+
+    def _runsToConvert(self, infiles, forced=()):
+        '''
+        :param infiles: Candidate *.toff files
+        :param forced: Files which have already been converted with force, which are then only converted again if they
+        are new or have changed
+        :return: The files which are new or have changed since they were last converted, or all files not yet forced
+        with force
+        '''
+        return [infile for infile in infiles
+                if (self.force and infile not in forced) or
+                not self.manifest.isUpToDate(infile, self._outputFile(infile), self.versions, self._hashRun,
+                                             self._sources(infile))]
+
+    def _sharedAxis(self, tof):
+        '''
+        Runs with identical binning share a single read-only TOF axis for the whole batch.
+        :param tof: TOF axis of a run
+        :return: The axis already in use for this binning, or tof if the binning has not been seen before.
+        '''
+        key = tof.tostring()
+        if key not in self.axes:
+            tof.flags.writeable = False
+            self.axes[key] = tof
+        return self.axes[key]
+
+    def _convertRun(self, file, tofData):
+        '''
+        Writes a single run with the chosen backend. Unless workspaces are kept by the mantid backend the workspace is
+        deleted straight away so only one run is held at a time.
+        :param file: The *.toff file, the file of the first bank for runs with a file per bank
+        :param tofData: Tof data loaded from the file
+        '''
+        tof, tofy = tofData
+        tof = self._sharedAxis(tof)
+        wsName = self._runName(file)
+        outfile = self._outputFile(file)
+
+        print "Saving ", outfile
+        self.writer.write(wsName, tof, tofy, outfile)
+
+    def _indexRuns(self, infiles):
+        '''
+        Scans the headers and row counts of the runs, and of every bank of runs with a file per bank, and validates
+        them against the valid detector IDs and the banks of the detector map. The index is kept so that parsing
+        allocates each file at its exact size.
+        :param infiles: *.toff files to index
+        :return: The index
+        '''
+        with Profiling.profiler.stage("indexRuns", spectra=len(infiles)):
+            self.index = BatchIndex.BatchIndex([f for infile in infiles for f in self._sources(infile)])
+            self.index.validate(self.validIDs)
+            self.index.groupBanks(dict((infile, self.runFiles.get(infile, [infile])) for infile in infiles),
+                                  self.numBanks)
+        print self.index.summary()
+        return self.index
+
+    def _convertRuns(self, infiles):
+        '''
+        Converts the given runs, recording each successful conversion in the manifest and reporting each failure.
+        :param infiles: *.toff files to convert
+        '''
+        for infile, tofData, error in self._loadRuns(infiles):
+            if error is None:
+                try:
+                    self._convertRun(infile, tofData)
+                    self.manifest.record(infile, self._outputFile(infile), self.versions, self._hashRun(infile),
+                                         self._sources(infile))
+                except Exception as e:
+                    error = type(e).__name__ + ": " + str(e)
+            if error is not None:
+                self._reportFailure(infile, error)
 
     def convert(self):
         '''
-        Perform conversion
+        Perform conversion of the runs which are new or have changed since the last conversion. The runs are first
+        indexed from their headers so that malformed runs fail the batch straight away, then converted grouped by
+        binning. Each run is loaded, saved and freed before the next one so that memory use does not depend on the
+        number of runs in the folder.
         '''
         print "Converting toff files to nexus"
-        self._loadRunsAndReturnWorkspaceNames()
-        self._saveNexusFiles()
-        print "Conversion complete files saved to ", self.folder
+        self._loadRunInvariants()
+        self._createWriter()
+        self.manifest = ConversionManifest.ConversionManifest(self.outFolder)
+        self.failures = []
+
+        infiles = self._listRuns()
+        toConvert = self._runsToConvert(infiles)
+        if len(toConvert) < len(infiles):
+            print "Skipping ", len(infiles) - len(toConvert), " runs which are already converted"
+
+        # fail before converting anything if any run is malformed or too short
+        index = self._indexRuns(toConvert)
+        if len(index.problems) > 0:
+            raise ValueError(str(len(index.problems)) + " file(s) cannot be converted:\n" +
+                             "\n".join(index.problems[infile] for infile in sorted(index.problems)))
+        self._convertRuns(index.scheduled())
+
+        if len(self.failures) > 0:
+            raise RuntimeError(str(len(self.failures)) + " file(s) failed to convert: " +
+                               ", ".join(infile for infile, message in self.failures))
+        print "Conversion complete files saved to ", self.outFolder
+
+    def _groupRuns(self, infiles, groupPattern):
+        '''
+        :param infiles: *.toff files
+        :param groupPattern: Optional regular expression searched for in each run name. Runs are grouped by its first
+        group, or by the whole match if it has no groups, and runs which do not match are left out. Without a pattern
+        all runs form a single group named summed.
+        :return: Dictionary of group name to the runs in the group
+        '''
+        groups = {}
+        for infile in infiles:
+            name = self._runName(infile)
+            if groupPattern is None:
+                key = "summed"
+            else:
+                match = re.search(groupPattern, name)
+                if match is None:
+                    print "Skipping ", infile, " which does not match ", groupPattern
+                    continue
+                key = match.group(1) if len(match.groups()) > 0 else match.group(0)
+            groups.setdefault(key, []).append(infile)
+        return groups
+
+    def _sumGroup(self, name, infiles):
+        '''
+        Streams the runs of a group through a single accumulator so that only one run is held besides the sum.
+        :param name: Name of the group, used for the workspace and output file
+        :param infiles: *.toff files with identical binning
+        '''
+        total = None
+        for infile, tofData, error in self._loadRuns(infiles):
+            if error is not None:
+                raise ValueError(infile + ": " + error)
+            tof, counts = tofData
+            if total is None:
+                # dense float counts are a new array from the gather which can be accumulated into
+                total = CompactCounts.expand(counts)
+            else:
+                with Profiling.profiler.stage("accumulate", infile, spectra=counts.shape[0], bins=counts.shape[1]):
+                    CompactCounts.addTo(total, counts)
+
+        outfile = os.path.join(self.outFolder, name + ".nxs")
+        print "Saving sum of ", len(infiles), " runs to ", outfile
+        self.writer.write(name, self._sharedAxis(tof), total, outfile)
+
+    def sumRuns(self, groupPattern=None):
+        '''
+        Sums runs into one output per group instead of converting each run. Runs in a group must have identical
+        binning. Memory use is that of one run and the sum whatever the number of runs.
+        :param groupPattern: Optional regular expression which groups runs by name, see _groupRuns.
+        '''
+        print "Summing toff files"
+        self._loadRunInvariants()
+        self._createWriter()
+        self.failures = []
+
+        index = self._indexRuns(self._listRuns())
+        if len(index.problems) > 0:
+            raise ValueError(str(len(index.problems)) + " file(s) cannot be summed:\n" +
+                             "\n".join(index.problems[infile] for infile in sorted(index.problems)))
+
+        groups = self._groupRuns(index.scheduled(), groupPattern)
+        for name in sorted(groups):
+            infiles = sorted(groups[name])
+            if len(set(index.entries[infile]["signature"] for infile in infiles)) > 1:
+                self._reportFailure(name, "the runs in the group do not all have the same binning")
+                continue
+            try:
+                self._sumGroup(name, infiles)
+            except Exception as e:
+                self._reportFailure(name, type(e).__name__ + ": " + str(e))
+
+        if len(self.failures) > 0:
+            raise RuntimeError(str(len(self.failures)) + " group(s) failed to sum: " +
+                               ", ".join(name for name, message in self.failures))
+        print "Summing complete files saved to ", self.outFolder
+
+    def integrateRegions(self, integrator):
+        '''
+        Integrates each run over the regions of a RegionIntegrator instead of converting it, writing the counts of each
+        region against TOF to <run>_regions.csv in the output folder.
+        :param integrator: RegionIntegrator which defines the regions
+        '''
+        print "Integrating regions of toff files"
+        self._loadRunInvariants()
+        integrator.load()
+        self.failures = []
+
+        index = self._indexRuns(self._listRuns())
+        if len(index.problems) > 0:
+            raise ValueError(str(len(index.problems)) + " file(s) cannot be integrated:\n" +
+                             "\n".join(index.problems[infile] for infile in sorted(index.problems)))
+
+        for infile, tofData, error in self._loadRuns(index.scheduled()):
+            if error is None:
+                try:
+                    tof, counts = tofData
+                    with Profiling.profiler.stage("integrateRegions", infile, spectra=counts.shape[0],
+                                                  bins=counts.shape[1]):
+                        intensities = integrator.integrate(counts)
+                    outfile = os.path.join(self.outFolder, self._runName(infile) + "_regions.csv")
+                    integrator.write(outfile, tof, intensities)
+                except Exception as e:
+                    error = type(e).__name__ + ": " + str(e)
+            if error is not None:
+                self._reportFailure(infile, error)
+
+        if len(self.failures) > 0:
+            raise RuntimeError(str(len(self.failures)) + " file(s) failed to integrate: " +
+                               ", ".join(infile for infile, message in self.failures))
+        print "Integration complete files saved to ", self.outFolder
+
+    def watch(self, interval=10.0):
+        '''
+        Polls the data folder and converts runs as they are written. A run is converted once its size and modification
+        time are unchanged between two polls, so files which are still being written are left alone. Failed runs are
+        retried only once they change. With force each run is converted when it is first seen, after which it is only
+        converted again if it changes. Runs until interrupted.
+        :param interval: Time between polls in seconds
+        '''
+        print "Watching ", self.folder, " for new toff files"
+        self._loadRunInvariants()
+        self._createWriter()
+        self.manifest = ConversionManifest.ConversionManifest(self.outFolder)
+        lastSeen = {}
+        failed = {}
+        forced = set()
+        while True:
+            seen = {}
+            for infile in self._listRuns():
+                seen[infile] = tuple((os.stat(f).st_size, os.stat(f).st_mtime) for f in self._sources(infile))
+            stable = [infile for infile in sorted(seen)
+                      if lastSeen.get(infile) == seen[infile] and failed.get(infile) != seen[infile]]
+
+            self.failures = []
+            index = self._indexRuns(self._runsToConvert(stable, forced))
+            forced.update(stable)
+            for infile in sorted(index.problems):
+                self._reportFailure(infile, index.problems[infile])
+            self._convertRuns(index.scheduled())
+            for infile, message in self.failures:
+                failed[infile] = seen.get(infile)
+
+            lastSeen = seen
+            time.sleep(interval)
 
 
 if __name__ == "__main__":
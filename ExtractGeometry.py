@@ -1,11 +1,26 @@
 import numpy
 import csv
 import copy
+import os
+import FileCache
+import Profiling
 
 
 class GeometryExtractor(object):
-    def __init__(self, coordinateFile):
+    # increment when the extracted state changes so that old cache entries are not used
+    version = 2
+
+    def __init__(self, coordinateFile, cacheFolder=None, invalidateCache=False):
+        '''
+        Constructor
+        :param coordinateFile: File which contains the engineering coordinates for detector pads
+        :param cacheFolder: Optional folder in which the extracted geometry is cached, keyed by the content hash of the
+        coordinate file and the extractor version. None disables the cache.
+        :param invalidateCache: If True the geometry is always extracted and the cache entry rewritten.
+        '''
         self.coordinateFile = coordinateFile
+        self.cache = FileCache.FileCache(cacheFolder)
+        self.invalidateCache = invalidateCache
 
     def _findCentre(self, x, y):
         x = numpy.array(x)
@@ -45,62 +60,50 @@ class GeometryExtractor(object):
                 self.x[i] = self.x[i] + self.xpositions[i]
                 self.y[i] = self.y[i] + self.ypositions[i]
 
-    def _extractMaps(self, vertPitchMapFull, detectorMapFull):
-        vertPitchMap = {}
-        detectorMap = {}
-        for key in sorted(vertPitchMapFull):
-            pitch, y1, y2 = key
-
-            y1 = numpy.around(y1, 4)
-            y2 = numpy.around(y2, 4)
-            k1 = (pitch, y1)
-            k2 = (pitch, y2)
-
-            xvals = vertPitchMapFull[key]
-            detIds = detectorMapFull[key]
-            for xcoords, id in zip(xvals, detIds):
-                if k1 in vertPitchMap:
-                    vertPitchMap[k1].append(xcoords[0])
-                    detectorMap[k1].append(id[0])
-                else:
-                    vertPitchMap[k1] = [xcoords[0]]
-                    detectorMap[k1] = [id[0]]
-                if k2 in vertPitchMap:
-                    vertPitchMap[k2].append(xcoords[1])
-                    detectorMap[k2].append(id[1])
-                else:
-                    vertPitchMap[k2] = [xcoords[1]]
-                    detectorMap[k2] = [id[1]]
-        return vertPitchMap, detectorMap
+    def _computePadShapes(self):
+        '''
+        Computes the area and centroid of every pad polygon at once with the shoelace formula. The corners are not
+        listed in the same order for every pad in coordinate.txt, so they are first ordered by their angle about the
+        mean of the corners.
+        '''
+        angles = numpy.arctan2(self.y - self.y.mean(axis=1)[:, numpy.newaxis],
+                               self.x - self.x.mean(axis=1)[:, numpy.newaxis])
+        pads = numpy.arange(len(self.x))[:, numpy.newaxis]
+        order = numpy.argsort(angles, axis=1)
+        x, y = self.x[pads, order], self.y[pads, order]
+        xnext = numpy.roll(x, -1, axis=1)
+        ynext = numpy.roll(y, -1, axis=1)
+        cross = x * ynext - xnext * y
+        signedArea = cross.sum(axis=1) / 2.0
+        self.areas = numpy.abs(signedArea)
+        self.centroidX = ((x + xnext) * cross).sum(axis=1) / (6.0 * signedArea)
+        self.centroidY = ((y + ynext) * cross).sum(axis=1) / (6.0 * signedArea)
+        self.cornerOrder = order
 
-    def _sanitiseMaps(self, vertPitchMap, detectorMap):
+    def solidAngles(self, distance, yOffset):
         '''
-        Removes duplicate x values for each row and matches detector IDs to vertices.
-        :param vertPitchMap:
-        :param detectorMap:
-        :return: sanitised maps
+        Solid angle of every pad seen from the sample, for pads in a plane normal to the beam at the given distance
+        and shifted along y by the given offset. Rotating a bank about the beam axis does not change them. Each pad is
+        split into two triangles whose solid angles are found with the formula of Van Oosterom and Strackee.
+        :param distance: Distance in metres from the sample to the plane of the pads
+        :param yOffset: Offset in metres of the pad coordinates along y
+        :return: Solid angle of each pad in steradians, in the order of detIDs
         '''
-        # sort and sanitise X values
-        for key in sorted(vertPitchMap):
-            allx = numpy.array(vertPitchMap[key])
-            sortedIndices = numpy.argsort(allx)
-            allx = allx[sortedIndices]
-            allids = numpy.array(detectorMap[key])
-            allids = allids[sortedIndices]
-            uxvals, uindices = numpy.unique(numpy.around(allx, 0), return_index=True)
-            allx = allx[uindices]
-            uindices, = numpy.where(numpy.diff(allx) < 2)
-            allx = allx.tolist()
-            if len(uindices) > 0:
-                for i in sorted(uindices, reverse=True):
-                    del allx[i]
-
-            vertPitchMap[key] = numpy.array(allx)
-            temp, indices = numpy.unique(allids, return_index=True)
-            indices.sort()
-            allids = numpy.array(allids)
-            detectorMap[key] = allids[indices]
-        return vertPitchMap, detectorMap
+        pads = numpy.arange(len(self.x))[:, numpy.newaxis]
+        corners = numpy.empty(self.x.shape + (3,))
+        corners[:, :, 0] = self.x[pads, self.cornerOrder] / 1000.0
+        corners[:, :, 1] = self.y[pads, self.cornerOrder] / 1000.0 + yOffset
+        corners[:, :, 2] = distance
+
+        total = numpy.zeros(len(corners))
+        for a, b, c in ((0, 1, 2), (0, 2, 3)):
+            ra, rb, rc = corners[:, a], corners[:, b], corners[:, c]
+            la, lb, lc = [numpy.sqrt((r * r).sum(axis=1)) for r in (ra, rb, rc)]
+            triple = (ra * numpy.cross(rb, rc)).sum(axis=1)
+            denominator = la * lb * lc + (ra * rb).sum(axis=1) * lc + (ra * rc).sum(axis=1) * lb + \
+                          (rb * rc).sum(axis=1) * la
+            total += 2.0 * numpy.abs(numpy.arctan2(triple, denominator))
+        return total
 
     def _assembleComponents(self, vertPitchMap, detectorMap):
         '''
@@ -131,33 +134,51 @@ class GeometryExtractor(object):
                 lastlen = len(vertPitchMap[key])
         self.components = self.components + [comp]
 
+    def _groupRows(self):
+        '''
+        Groups the pad corners into rows of vertices with one lexsort. Corners are keyed by the pad pitch and their y
+        value quantised to 1e-4, duplicate and nearly coincident x values are then removed along each row.
+        :return: maps of (pitch, y) to the sorted x values and to the detector IDs along each row
+        '''
+        pitch = numpy.repeat(numpy.around(self.y.max(axis=1) - self.y.min(axis=1)), 4)
+        yvals = numpy.around(self.y.ravel(), 4)
+        yquant = numpy.rint(self.y.ravel() * 1e4).astype(numpy.int64)
+        xvals = self.x.ravel()
+        ids = numpy.repeat(self.detIDs, 4)
+
+        order = numpy.lexsort((xvals, yquant, pitch))
+        pitch, yvals, yquant, xvals, ids = pitch[order], yvals[order], yquant[order], xvals[order], ids[order]
+        newRow = numpy.ones(len(order), dtype=bool)
+        newRow[1:] = (pitch[1:] != pitch[:-1]) | (yquant[1:] != yquant[:-1])
+        rows = numpy.cumsum(newRow) - 1
+        rowStarts = numpy.flatnonzero(newRow)
+
+        # keep the first of each x value rounded to the nearest mm, then drop any x value within 2mm of the next one
+        xrounded = numpy.around(xvals, 0)
+        keep = newRow.copy()
+        keep[1:] |= xrounded[1:] != xrounded[:-1]
+        xvals, xrows = xvals[keep], rows[keep]
+        close = numpy.zeros(len(xvals), dtype=bool)
+        close[:-1] = (xrows[1:] == xrows[:-1]) & (numpy.diff(xvals) < 2)
+        xvals, xrows = xvals[~close], xrows[~close]
+
+        # detector IDs along each row in order of their first appearance
+        idOrder = numpy.lexsort((numpy.arange(len(ids)), ids, rows))
+        first = numpy.ones(len(idOrder), dtype=bool)
+        first[1:] = (rows[idOrder][1:] != rows[idOrder][:-1]) | (ids[idOrder][1:] != ids[idOrder][:-1])
+        firstIndices = numpy.sort(idOrder[first])
+        rowIds, idRows = ids[firstIndices], rows[firstIndices]
+
+        keys = zip(pitch[rowStarts], yvals[rowStarts])
+        xsplit = numpy.split(xvals, numpy.flatnonzero(numpy.diff(xrows)) + 1)
+        idsplit = numpy.split(rowIds, numpy.flatnonzero(numpy.diff(idRows)) + 1)
+        return dict(zip(keys, xsplit)), dict(zip(keys, idsplit))
+
     def _findComponents(self):
-        vertPitchMapFull = {}
-        detectorMapFull = {}
-        # Create a map of pitch and y values corresponding to x corner values.
-        for y, x, detID in zip(self.y, self.x, self.detIDs):
-            y = numpy.array(y)
-            pitch = numpy.around(y.max() - y.min())
-            key1 = (pitch, y[0], y[1])
-            key2 = (pitch, y[2], y[3])
-            if key1 in vertPitchMapFull:
-                vertPitchMapFull[key1].append(numpy.array([x[0], x[1]]))
-                detectorMapFull[key1].append((numpy.array([detID, detID])))
-            else:
-                vertPitchMapFull[key1] = [numpy.array([x[0], x[1]])]
-                detectorMapFull[key1] = [numpy.array([detID, detID])]
-            if key2 in vertPitchMapFull:
-                vertPitchMapFull[key2].append(numpy.array([x[2], x[3]]))
-                detectorMapFull[key2].append((numpy.array([detID, detID])))
-            else:
-                vertPitchMapFull[key2] = [numpy.array([x[2], x[3]])]
-                detectorMapFull[key2] = [numpy.array([detID, detID])]
-
-        vertPitchMap, detectorMap = self._extractMaps(vertPitchMapFull, detectorMapFull)
-        vertPitchMap, detectorMap = self._sanitiseMaps(vertPitchMap, detectorMap)
+        vertPitchMap, detectorMap = self._groupRows()
         self._assembleComponents(vertPitchMap, detectorMap)
 
-    def getPosOffset(self):
+    def _findPosOffset(self):
         set1 = self.components[0][0]
         set2 = self.components[-1][-1]
 
@@ -190,11 +211,64 @@ class GeometryExtractor(object):
                 print line, c[0], ":", c[1][0], "-", c[1][-1], " size:", len(c[1])
                 line += 1
 
+    def _saveState(self, key):
+        '''
+        Flattens the components into arrays of rows, with the vertices and IDs of all rows concatenated.
+        '''
+        rows = [(i, c) for i, comp in enumerate(self.components) for c in comp]
+        self.cache.save("geometry", key, detIDs=self.detIDs, xpositions=self.xpositions, ypositions=self.ypositions,
+                        x=self.x, y=self.y, posOffset=self.posOffset,
+                        areas=self.areas, centroidX=self.centroidX, centroidY=self.centroidY,
+                        cornerOrder=self.cornerOrder,
+                        rowComponent=numpy.array([i for i, c in rows]),
+                        rowY=numpy.array([c[0] for i, c in rows]),
+                        rowXLengths=numpy.array([len(c[1]) for i, c in rows]),
+                        rowX=numpy.concatenate([c[1] for i, c in rows]),
+                        rowIdLengths=numpy.array([len(c[2]) for i, c in rows]),
+                        rowIds=numpy.concatenate([c[2] for i, c in rows]))
+
+    def _loadState(self, state):
+        self.detIDs = state["detIDs"]
+        self.xpositions = state["xpositions"]
+        self.ypositions = state["ypositions"]
+        self.x = state["x"]
+        self.y = state["y"]
+        self.posOffset = state["posOffset"][()]
+        self.areas = state["areas"]
+        self.centroidX = state["centroidX"]
+        self.centroidY = state["centroidY"]
+        self.cornerOrder = state["cornerOrder"]
+
+        rowX = numpy.split(state["rowX"], numpy.cumsum(state["rowXLengths"])[:-1])
+        rowIds = numpy.split(state["rowIds"], numpy.cumsum(state["rowIdLengths"])[:-1])
+        self.components = [[] for i in xrange(state["rowComponent"].max() + 1)]
+        for comp, y, xvals, ids in zip(state["rowComponent"], state["rowY"], rowX, rowIds):
+            self.components[comp].append((y, xvals, ids))
+
     def extract(self):
-        self._extractCoordinates()
-        self._findComponents()
-        self._sortComponents()
+        key = self.cache.hashFiles([self.coordinateFile], "GeometryExtractor" + str(self.version))
+        profiler = Profiling.profiler
+        if not self.invalidateCache:
+            with profiler.stage("loadGeometryCache", self.coordinateFile):
+                state = self.cache.load("geometry", key)
+                if state is not None:
+                    self._loadState(state)
+            if state is not None:
+                print "Geometry loaded from cache, ", len(self.detIDs), " detectors"
+                return
+
+        with profiler.stage("extractCoordinates", self.coordinateFile, os.path.getsize(self.coordinateFile)):
+            self._extractCoordinates()
+            self._computePadShapes()
+        with profiler.stage("findComponents", self.coordinateFile, spectra=len(self.detIDs)):
+            self._findComponents()
+            self._sortComponents()
         self._componentsPrintout()
+        self.posOffset = self._findPosOffset()
+        self._saveState(key)
+
+    def getPosOffset(self):
+        return self.posOffset
 
     def getNumComponents(self):
         return len(self.components)
@@ -0,0 +1,113 @@
+import hashlib
+import numpy
+import os
+import shutil
+
+# shared by the table, run, geometry and region caches, whose entries are told apart by their prefix and key
+defaultFolder = ".loki_cache"
+
+class FileCache(object):
+    '''
+    On-disk cache for arrays derived from input files. Entries are keyed by the content hash of the files they were
+    derived from so that editing an input file invalidates its entries.
+    '''
+
+    def __init__(self, folder):
+        '''
+        Constructor
+        :param folder: Folder which holds the cache entries. If None, caching is disabled.
+        '''
+        self.folder = folder
+
+    def hashFiles(self, filenames, extra=""):
+        '''
+        Hashes the contents of the given files.
+        :param filenames: Files to hash, empty names are skipped.
+        :param extra: Optional string which is mixed into the hash, e.g. a format version.
+        :return: Hex digest
+        '''
+        sha = hashlib.sha1()
+        for filename in filenames:
+            if filename == "":
+                continue
+            with open(filename, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    sha.update(block)
+        sha.update(extra)
+        return sha.hexdigest()
+
+    def _entryPath(self, prefix, key):
+        return os.path.join(self.folder, prefix + "_" + key + ".npz")
+
+    def load(self, prefix, key):
+        '''
+        :param prefix: Name of the kind of entry
+        :param key: Hash the entry was saved under
+        :return: Dictionary of arrays or None if there is no entry.
+        '''
+        if self.folder is None:
+            return None
+        path = self._entryPath(prefix, key)
+        if not os.path.exists(path):
+            return None
+        with numpy.load(path) as entry:
+            return dict((name, entry[name]) for name in entry.files)
+
+    def loadMapped(self, prefix, key):
+        '''
+        Loads an entry saved with saveMapped with every array memory-mapped read-only, so that only the parts which are
+        used are read from disk.
+        :param prefix: Name of the kind of entry
+        :param key: Hash the entry was saved under
+        :return: Dictionary of arrays or None if there is no entry.
+        '''
+        if self.folder is None:
+            return None
+        path = os.path.join(self.folder, prefix + "_" + key)
+        if not os.path.isdir(path):
+            return None
+        return dict((name[:-len(".npy")], numpy.load(os.path.join(path, name), mmap_mode="r"))
+                    for name in os.listdir(path) if name.endswith(".npy"))
+
+    def saveMapped(self, prefix, key, **arrays):
+        '''
+        Saves each array as its own .npy file in a folder for the entry, which allows them to be memory-mapped.
+        :param prefix: Name of the kind of entry
+        :param key: Hash to save the entry under
+        :param arrays: Arrays to store
+        '''
+        if self.folder is None:
+            return
+        path = os.path.join(self.folder, prefix + "_" + key)
+        if os.path.isdir(path):
+            return
+        tmpPath = path + "." + str(os.getpid()) + ".tmp"
+        os.makedirs(tmpPath)
+        for name, array in arrays.items():
+            numpy.save(os.path.join(tmpPath, name + ".npy"), array)
+        try:
+            os.rename(tmpPath, path)
+        except OSError:
+            # another process saved the same entry first
+            shutil.rmtree(tmpPath)
+
+    def save(self, prefix, key, **arrays):
+        '''
+        Saves arrays under the given key. The entry is written to a temporary file first so that readers never see a
+        partially written entry.
+        :param prefix: Name of the kind of entry
+        :param key: Hash to save the entry under
+        :param arrays: Arrays to store
+        '''
+        if self.folder is None:
+            return
+        try:
+            os.makedirs(self.folder)
+        except OSError:
+            if not os.path.isdir(self.folder):
+                raise
+        path = self._entryPath(prefix, key)
+        tmpPath = path + "." + str(os.getpid()) + ".tmp"
+        with open(tmpPath, "wb") as f:
+            numpy.savez(f, **arrays)
+        os.rename(tmpPath, path)
@@ -1,13 +1,40 @@
 import ExtractGeometry
+import FileCache
 import math
+import numpy
+import os
+import Profiling
 
 
 class LOKIGenerator(object):
-    def __init__(self, coordFile, numBanks=1):
-        self.extractor = ExtractGeometry.GeometryExtractor(coordFile)
+    # panels lie this far beyond the sample along the beam, in metres
+    panelDistance = 3.406
+    # rotation of the first bank about the beam axis and between successive banks, in degrees
+    firstBankAngle = 90.0
+    bankAngleStep = 45
+
+    @staticmethod
+    def mapBanks(physicalIds):
+        '''
+        The detector map is written bank by bank, so the bank of a row is the number of earlier rows with its physical
+        ID.
+        :param physicalIds: Physical ID column of the detector map
+        :return: Bank of each row
+        '''
+        order = numpy.argsort(physicalIds, kind="mergesort")
+        newId = numpy.ones(len(order), dtype=bool)
+        newId[1:] = physicalIds[order][1:] != physicalIds[order][:-1]
+        starts = numpy.flatnonzero(newId)
+        bank = numpy.empty(len(order), dtype=int)
+        bank[order] = numpy.arange(len(order)) - numpy.repeat(starts, numpy.diff(numpy.append(starts, len(order))))
+        return bank
+
+    def __init__(self, coordFile, numBanks=1, cacheFolder=None, rebuildCache=False):
+        self.extractor = ExtractGeometry.GeometryExtractor(coordFile, cacheFolder, rebuildCache)
         self.numBanks = numBanks
         self.outFile = open("LOKI_BANDGEM_definition.xml", "w")
         self.mapFile = open("LOKI_map.csv", "w")
+        self.pixelFile = "LOKI_pixels.npy"
         self.pi = math.pi
         self.piDiv = self.pi / 180.0
 
@@ -50,7 +77,7 @@ class LOKIGenerator(object):
         self.outFile.write("</component>\n")
         self.outFile.write("<type name=\"some-sample-holder\" is=\"SamplePos\" />\n\n")
 
-    def _writeMonitors(self, monitorID):
+    def _writeMonitors(self, monitorID, physicalMonitorID):
         self.outFile.write("<component type=\"Moderator-Monitor4\" idlist=\"monitors\">\n")
         self.outFile.write("\t<location z=\"25.760\" name=\"monitor4\" />\n")
         self.outFile.write("</component>\n\n")
@@ -69,7 +96,7 @@ class LOKIGenerator(object):
         self.outFile.write("<idlist idname=\"monitors\">\n")
         self.outFile.write("\t<id val=\"" + str(monitorID) + "\" />\n")
         self.outFile.write("</idlist>\n\n")
-        self.mapFile.write("2496," + str(monitorID)+"\n")
+        self.mapFile.write(str(physicalMonitorID) + "," + str(monitorID)+"\n")
 
     def _writeStructuredPanel(self, compIndex):
         component = self.extractor.getComponent(compIndex)
@@ -82,57 +109,65 @@ class LOKIGenerator(object):
             compIndex) + "\" is=\"StructuredDetector\" xpixels=\"" + str(xpixels) + "\" ypixels=\"" + str(
             ypixels) + "\" type=\"pixel\">\n")
 
-        idlist = []
-        for i, set in enumerate(component):
-            y = set[0]
+        lines = []
+        for set in component:
+            y = str(set[0] / 1000.0)
             xmin = set[1][0]
             xmax = set[1][-1]
             pitch = (xmax - xmin) / (len(set[1]) - 1)
-            xval = xmin
-            for x in set[1]:
-                self.outFile.write("\t<vertex x=\"" + str(xval / 1000.0) + "\" y=\"" + str(y / 1000.0) + "\"/>\n")
-                xval += pitch
-            for id in set[2]:
-                if id not in idlist and i != len(component):
-                    idlist.append(id)
-        self.outFile.write("</type>\n\n")
-        return idlist
+            # the running sum reproduces the vertex positions of stepping xval by pitch
+            xvals = numpy.cumsum(numpy.concatenate(([xmin], numpy.repeat(pitch, len(set[1]) - 1)))) / 1000.0
+            lines.extend("\t<vertex x=\"" + str(x) + "\" y=\"" + y + "\"/>\n" for x in xvals)
+        lines.append("</type>\n\n")
+        self.outFile.write("".join(lines))
+
+        # detector IDs in order of their first appearance in the component
+        ids = numpy.concatenate([set[2] for set in component])
+        unique, firstIndices = numpy.unique(ids, return_index=True)
+        return ids[numpy.sort(firstIndices)]
+
+    def _panelSizes(self):
+        '''
+        :return: Number of pixels along x and y for each panel
+        '''
+        sizes = []
+        for i in xrange(self.extractor.getNumComponents()):
+            component = self.extractor.getComponent(i)
+            sizes.append((len(component[0][1]) - 1, len(component) - 1))
+        return sizes
 
     def _writeCompAssemblies(self):
         r = self.extractor.getPosOffset() / 1000.0
-        angle = 90.0
-        start = 0
-        idstart = []
+        angle = self.firstBankAngle
+        sizes = self._panelSizes()
+        numPanels = len(sizes)
+        bankPixels = sum(xpixels * ypixels for xpixels, ypixels in sizes)
+
+        # each bank differs only in its location and the idstart of its panels, the panel types are shared
+        panelStarts = numpy.cumsum([0] + [xpixels * ypixels for xpixels, ypixels in sizes[:-1]])
+        panelTemplates = ["<component type=\"Structured_" + str(i) + "\" idstart=\"%d\" idfillbyfirst=\"x\" idstepbyrow=\"" +
+                          str(xpixels) + "\" idstep=\"1\">\n\t<location x=\"0.0\" y=\"0.0\" z=\"" + str(self.panelDistance) +
+                          "\" />\n</component>\n"
+                          for i, (xpixels, ypixels) in enumerate(sizes)]
+
+        lines = []
         for i in xrange(self.numBanks):
-            self.outFile.write("<component type=\"bank_" + str(i) + "\">\n")
+            lines.append("<component type=\"bank_" + str(i) + "\">\n")
             x = -r * math.sin(self.piDiv * angle)
             y = r * math.cos(self.piDiv * angle)
-            self.outFile.write("\t<location x=\"" + str(x) + "\" y=\"" + str(y) + "\" z=\"25.300\" rot=\"" + str(
+            lines.append("\t<location x=\"" + str(x) + "\" y=\"" + str(y) + "\" z=\"25.300\" rot=\"" + str(
                 angle) + "\" axis-x=\"0.0\" axis-y=\"0.0\" axis-z=\"1.0\" />\n")
-            self.outFile.write("</component>\n")
-            angle += 45
-
-            self.outFile.write("\n\n")
-
-            self.outFile.write("<type name=\"bank_" + str(i) + "\">\n")
-            self.outFile.write("<properties />\n")
-
-            numPanels = self.extractor.getNumComponents()
-
-            starts = []
-            for i in xrange(numPanels):
-                starts.append(start)
-                component = self.extractor.getComponent(i)
-                xpixels = len(component[0][1]) - 1
-                ypixels = len(component) - 1
-                self.outFile.write(
-                    "<component type=\"Structured_" + str(i) + "\" idstart=\"" + str(
-                        start) + "\" idfillbyfirst=\"x\" idstepbyrow=\"" + str(xpixels) + "\" idstep=\"1\">\n")
-                self.outFile.write("\t<location x=\"0.0\" y=\"0.0\" z=\"3.406\" />\n")
-                self.outFile.write("</component>\n")
-                start += (xpixels * ypixels)
-            idstart.append(starts)
-            self.outFile.write("</type>\n\n")
+            lines.append("</component>\n")
+            angle += self.bankAngleStep
+
+            lines.append("\n\n")
+
+            lines.append("<type name=\"bank_" + str(i) + "\">\n")
+            lines.append("<properties />\n")
+            for template, start in zip(panelTemplates, panelStarts + i * bankPixels):
+                lines.append(template % start)
+            lines.append("</type>\n\n")
+        self.outFile.write("".join(lines))
 
         idlists = []
         for i in xrange(numPanels):
@@ -140,35 +175,73 @@ class LOKIGenerator(object):
 
         self.outFile.write("<type is=\"detector\" name=\"pixel\" />\n\n")
 
-        for i in xrange(self.numBanks):
-            for j, idlist in enumerate(idlists):
-                start = idstart[i][j]
-                for k, id in enumerate(idlist):
-                    self.mapFile.write(str(int(id)) + "," + str(start + k) + "\n")
+        # physical IDs of one bank against their offset within the bank, repeated for every bank
+        physicalIds = numpy.concatenate(idlists).astype(int)
+        offsets = numpy.concatenate([start + numpy.arange(len(idlist)) for start, idlist in zip(panelStarts, idlists)])
+        rows = numpy.empty((self.numBanks * len(physicalIds), 2), dtype=int)
+        rows[:, 0] = numpy.tile(physicalIds, self.numBanks)
+        rows[:, 1] = (offsets[numpy.newaxis, :] + bankPixels * numpy.arange(self.numBanks)[:, numpy.newaxis]).ravel()
+        self.mapFile.write("".join("%d,%d\n" % (physicalId, id) for physicalId, id in rows.tolist()))
+        self._writePixelTable(physicalIds, offsets, bankPixels)
+
+    def _writePixelTable(self, physicalIds, offsets, bankPixels):
+        '''
+        Writes the area, centroid and solid angle of every pixel as a binary table with one row per IDF detector ID, so
+        that runs can be normalised without recomputing them from the IDF. The columns are named fields of a
+        structured array which numpy.load reads back without parsing text.
+        :param physicalIds: Physical IDs of the pads of one bank
+        :param offsets: IDF detector ID of each of those pads within the bank
+        :param bankPixels: Number of detector IDs in a bank
+        '''
+        extractor = self.extractor
+        r = extractor.getPosOffset() / 1000.0
+        sortedIDs = numpy.argsort(extractor.detIDs)
+        pads = sortedIDs[numpy.searchsorted(extractor.detIDs[sortedIDs], physicalIds)]
+        solidAngles = extractor.solidAngles(self.panelDistance, r)[pads]
+
+        # centroids in the bank frame, then rotated about the beam axis by the angle of each bank
+        cx = extractor.centroidX[pads] / 1000.0
+        cy = extractor.centroidY[pads] / 1000.0 + r
+        angles = numpy.radians(self.firstBankAngle + self.bankAngleStep * numpy.arange(self.numBanks))[:, numpy.newaxis]
+
+        table = numpy.zeros(self.numBanks * bankPixels, dtype=[("id", numpy.int32), ("physicalId", numpy.int32),
+                                                               ("area", float), ("x", float), ("y", float),
+                                                               ("z", float), ("solidAngle", float)])
+        ids = (offsets[numpy.newaxis, :] + bankPixels * numpy.arange(self.numBanks)[:, numpy.newaxis]).ravel()
+        table["id"] = numpy.arange(len(table))
+        table["physicalId"] = -1 # IDs of the structured detectors without a pad
+        table["physicalId"][ids] = numpy.tile(physicalIds, self.numBanks)
+        table["area"][ids] = numpy.tile(extractor.areas[pads] / 1e6, self.numBanks)
+        table["x"][ids] = (cx * numpy.cos(angles) - cy * numpy.sin(angles)).ravel()
+        table["y"][ids] = (cx * numpy.sin(angles) + cy * numpy.cos(angles)).ravel()
+        table["z"][ids] = self.panelDistance
+        table["solidAngle"][ids] = numpy.tile(solidAngles, self.numBanks)
+        numpy.save(self.pixelFile, table)
 
     def generate(self):
-        self._writeInstrumentHeader()
-        self._writeDefaults()
-        self._writeLARMORSourceAndSample()
+        profiler = Profiling.profiler
+        with profiler.stage("extractGeometry"):
+            self.extractor.extract()
 
-        self.extractor.extract()
-        monitorID = 0
-        for i in xrange(self.extractor.getNumComponents()):
-            component = self.extractor.getComponent(i)
-            xpixels = len(component[0][1]) - 1
-            ypixels = len(component) - 1
-            monitorID += (xpixels * ypixels)
-        monitorID *= self.numBanks
+        with profiler.stage("writeIDF", spectra=self.numBanks * len(self.extractor.detIDs)) as record:
+            self._writeInstrumentHeader()
+            self._writeDefaults()
+            self._writeLARMORSourceAndSample()
+
+            monitorID = self.numBanks * sum(xpixels * ypixels for xpixels, ypixels in self._panelSizes())
 
-        self._writeMonitors(monitorID)
-        self._writeCompAssemblies()
-        self._writeInstrumentFooter()
-        self.outFile.close()
-        self.mapFile.close()
+            # the monitor follows the last pad in the runs
+            self._writeMonitors(monitorID, int(self.extractor.detIDs[-1]) + 1)
+            self._writeCompAssemblies()
+            self._writeInstrumentFooter()
+            self.outFile.close()
+            self.mapFile.close()
+            record["bytesWritten"] = os.path.getsize(self.outFile.name) + os.path.getsize(self.mapFile.name) + \
+                                     os.path.getsize(self.pixelFile)
 
 
 if __name__ == "__main__":
-    generator = LOKIGenerator("coordinate.txt", 1)
+    generator = LOKIGenerator("coordinate.txt", 1, FileCache.defaultFolder)
     generator.generate()
 
     print
@@ -0,0 +1,175 @@
+import numpy
+import os
+import time
+import CompactCounts
+import Profiling
+
+try:
+    from mantid.simpleapi import CreateWorkspace, DeleteWorkspace, LoadInstrument, SaveNexus
+except ImportError:
+    CreateWorkspace = None
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+class MantidWriter(object):
+    '''
+    Writes runs by creating a workspace, loading the instrument and saving with SaveNexus. Must be run in mantidpython.
+    '''
+
+    def __init__(self, IDF, keepWorkspaces=False):
+        '''
+        Constructor
+        :param IDF: Instrument definition file which contains instrument geometry.
+        :param keepWorkspaces: If True the workspaces are left in the ADS, otherwise each workspace is deleted as soon
+        as it has been saved.
+        '''
+        if CreateWorkspace is None:
+            raise ImportError("The mantid backend must be run from mantidpython")
+        self.idf = IDF
+        self.keepWorkspaces = keepWorkspaces
+        self.wsNames = []
+
+    def write(self, wsName, tof, counts, outfile):
+        '''
+        :param wsName: Name of the workspace
+        :param tof: TOF axis shared by all spectra
+        :param counts: Counts for each spectrum, dense or as CompactCounts which are expanded here
+        :param outfile: Nexus file to write
+        '''
+        profiler = Profiling.profiler
+        numSpectra, numBins = counts.shape
+        counts = CompactCounts.expand(counts)
+        with profiler.stage("CreateWorkspace", outfile, spectra=numSpectra, bins=numBins):
+            # a single spectrum's worth of X is shared by every spectrum of the workspace
+            ws = CreateWorkspace(tof, counts, NSpec=numSpectra, OutputWorkspace=wsName)
+        try:
+            with profiler.stage("LoadInstrument", outfile, bytesRead=os.path.getsize(self.idf)):
+                LoadInstrument(ws, True, self.idf)
+            with profiler.stage("SaveNexus", outfile, spectra=numSpectra, bins=numBins) as record:
+                SaveNexus(ws, outfile)
+                record["bytesWritten"] = os.path.getsize(outfile)
+        finally:
+            if self.keepWorkspaces:
+                self.wsNames.append(wsName)
+            else:
+                DeleteWorkspace(ws)
+
+
+class H5pyWriter(object):
+    '''
+    Writes runs directly as Mantid processed NeXus files with h5py, so conversion does not need Mantid. The layout is
+    the one written by SaveNexus for a workspace made by CreateWorkspace and LoadInstrument with RewriteSpectraMap:
+    spectrum i has spectrum number i + 1 and detector ID i, and the IDF is embedded for LoadNexusProcessed.
+    '''
+
+    def __init__(self, IDF, compression=4, chunkSpectra=64):
+        '''
+        Constructor
+        :param IDF: Instrument definition file which contains instrument geometry.
+        :param compression: gzip level of the data sets, 0 disables compression.
+        :param chunkSpectra: Number of spectra in each chunk of the data sets.
+        '''
+        if h5py is None:
+            raise ImportError("The h5py backend requires h5py")
+        with open(IDF, "r") as f:
+            self.idfXml = f.read()
+        self.compression = compression
+        self.chunkSpectra = chunkSpectra
+
+    def _string(self, group, name, value):
+        # one element arrays of fixed length strings, as the NeXus API writes NXchar, so Mantid can read them
+        group.create_dataset(name, data=numpy.array([value], dtype="S" + str(max(1, len(value)))))
+
+    def _group(self, parent, name, nxClass):
+        group = parent.create_group(name)
+        group.attrs["NX_class"] = numpy.string_(nxClass)
+        return group
+
+    def _dataset(self, group, name, data=None, shape=None, dtype=float):
+        options = {}
+        if shape is None:
+            shape = data.shape
+        if len(shape) == 2:
+            options["chunks"] = (max(1, min(self.chunkSpectra, shape[0])), shape[1])
+            if self.compression > 0:
+                options["compression"] = "gzip"
+                options["compression_opts"] = self.compression
+        return group.create_dataset(name, shape=shape, dtype=dtype, data=data, **options)
+
+    def _writeInstrument(self, entry, numSpectra):
+        instrument = self._group(entry, "instrument", "NXinstrument")
+        self._string(instrument, "name", "LOKI")
+
+        xml = self._group(instrument, "instrument_xml", "NXnote")
+        self._string(xml, "data", self.idfXml)
+        self._string(xml, "type", "text/xml")
+        self._string(xml, "description", "XML contents of the instrument IDF")
+
+        detector = self._group(instrument, "detector", "NXdetector")
+        ids = numpy.arange(numSpectra, dtype=numpy.int32)
+        detector.create_dataset("detector_index", data=ids)
+        detector.create_dataset("detector_count", data=numpy.ones(numSpectra, dtype=numpy.int32))
+        detector.create_dataset("detector_list", data=ids)
+        detector.create_dataset("spectra", data=ids + 1)
+
+    def _writeValues(self, workspace, counts):
+        '''
+        Dense float counts are written in one go, other counts are expanded one chunk of spectra at a time so the
+        float counts of the whole run are never held.
+        '''
+        if isinstance(counts, numpy.ndarray) and counts.dtype == float:
+            return self._dataset(workspace, "values", data=counts)
+        values = self._dataset(workspace, "values", shape=counts.shape)
+        step = max(1, self.chunkSpectra)
+        for start in xrange(0, counts.shape[0], step):
+            stop = min(start + step, counts.shape[0])
+            values[start:stop] = CompactCounts.expand(counts, start, stop)
+        return values
+
+    def write(self, wsName, tof, counts, outfile):
+        '''
+        :param wsName: Name of the workspace
+        :param tof: TOF axis shared by all spectra
+        :param counts: Counts for each spectrum, dense or as CompactCounts which are expanded a chunk at a time
+        :param outfile: Nexus file to write
+        '''
+        numSpectra, numBins = counts.shape
+        with Profiling.profiler.stage("writeNexus", outfile, spectra=numSpectra, bins=numBins) as record:
+            self._write(wsName, tof, counts, outfile)
+            record["bytesWritten"] = os.path.getsize(outfile)
+
+    def _write(self, wsName, tof, counts, outfile):
+        tmpFile = outfile + ".tmp"
+        with h5py.File(tmpFile, "w") as f:
+            f.attrs["NeXus_version"] = numpy.string_("4.3.0")
+            f.attrs["file_name"] = numpy.string_(outfile)
+            f.attrs["HDF5_Version"] = numpy.string_(h5py.version.hdf5_version)
+            f.attrs["file_time"] = numpy.string_(time.strftime("%Y-%m-%dT%H:%M:%S"))
+
+            entry = self._group(f, "mantid_workspace_1", "NXentry")
+            self._string(entry, "title", wsName)
+            self._string(entry, "workspace_name", wsName)
+            self._string(entry, "definition", "Mantid Processed Workspace")
+            self._string(entry, "program_name", "mantid")
+
+            workspace = self._group(entry, "workspace", "NXdata")
+            values = self._writeValues(workspace, counts)
+            values.attrs["signal"] = 1
+            values.attrs["axes"] = numpy.string_("axis2,axis1")
+            values.attrs["units"] = numpy.string_("Counts")
+            # CreateWorkspace is given no errors, they are left to the fill value of zero
+            self._dataset(workspace, "errors", shape=counts.shape)
+            axis1 = workspace.create_dataset("axis1", data=tof)
+            axis1.attrs["units"] = numpy.string_("Empty")
+            axis2 = workspace.create_dataset("axis2", data=numpy.arange(1, counts.shape[0] + 1, dtype=float))
+            axis2.attrs["units"] = numpy.string_("spectraNumber")
+
+            self._writeInstrument(entry, counts.shape[0])
+
+            sample = self._group(entry, "sample", "NXsample")
+            self._string(sample, "name", "")
+        os.rename(tmpFile, outfile)
@@ -0,0 +1,165 @@
+import cProfile
+import contextlib
+import json
+import pstats
+import resource
+import time
+
+
+def _peakRssMB():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _currentRssMB():
+    '''
+    :return: Resident memory of the process in megabytes, None where /proc is not available
+    '''
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 1048576.0
+    except (IOError, IndexError, ValueError):
+        return None
+
+
+class _CollectedStats(object):
+    '''
+    cProfile statistics passed back from a pool worker, in the form pstats.Stats loads from a profiler.
+    '''
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+class StageProfiler(object):
+    '''
+    Records the wall time, memory, bytes read and written and spectra and bins handled by each stage of a
+    conversion, per file where the stage works on a file. Disabled profilers record nothing.
+
+    The memory of a stage is the change in resident memory from its start to its end, rssChangeMB, and how far it
+    raised the high-water mark of the process, peakRssIncreaseMB, which also catches memory freed before the stage
+    ends. processPeakRssMB is the high-water mark of the whole process so far, not of the stage.
+    '''
+
+    def __init__(self):
+        self.enabled = False
+        self.records = []
+        self.cProfileStage = None
+        self.cProfile = None
+        self.cProfileStats = [] # statistics of the cProfile stage taken from this process and the pool workers
+
+    def enable(self, cProfileStage=None):
+        '''
+        :param cProfileStage: Optional name of a stage which is also run under cProfile
+        '''
+        self.enabled = True
+        self.cProfileStage = cProfileStage
+        if cProfileStage is not None:
+            self.cProfile = cProfile.Profile()
+
+    @contextlib.contextmanager
+    def stage(self, name, file=None, bytesRead=0, spectra=0, bins=0):
+        '''
+        Times the enclosed block. The yielded record may be updated inside the block, e.g. with bytesWritten once the
+        output is known.
+        :param name: Name of the stage
+        :param file: Optional file the stage works on
+        :param bytesRead: Bytes read by the stage
+        :param spectra: Number of spectra handled by the stage
+        :param bins: Number of bins in each spectrum
+        '''
+        record = {"stage": name, "file": file, "bytesRead": bytesRead, "bytesWritten": 0, "spectra": spectra,
+                  "bins": bins}
+        if not self.enabled:
+            yield record
+            return
+
+        profile = self.cProfile if name == self.cProfileStage else None
+        startRss = _currentRssMB()
+        startPeakRss = _peakRssMB()
+        start = time.time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield record
+        finally:
+            if profile is not None:
+                profile.disable()
+            record["seconds"] = time.time() - start
+            endRss = _currentRssMB()
+            record["rssChangeMB"] = None if startRss is None or endRss is None else endRss - startRss
+            record["processPeakRssMB"] = _peakRssMB()
+            record["peakRssIncreaseMB"] = record["processPeakRssMB"] - startPeakRss
+            self.records.append(record)
+
+    def popRecords(self):
+        '''
+        :return: The records so far, which are then cleared. Used to pass records from pool workers to the parent.
+        '''
+        records = self.records
+        self.records = []
+        return records
+
+    def addRecords(self, records):
+        self.records.extend(records)
+
+    def popStats(self):
+        '''
+        :return: The cProfile statistics of the stage so far, which are then cleared, or None if the stage has not run.
+        Used to pass the statistics from pool workers to the parent, as with popRecords.
+        '''
+        if self.cProfile is None:
+            return None
+        self.cProfile.create_stats()
+        stats = self.cProfile.stats
+        self.cProfile = cProfile.Profile()
+        return stats if len(stats) > 0 else None
+
+    def addStats(self, stats):
+        if stats is not None:
+            self.cProfileStats.append(stats)
+
+    def _summarise(self):
+        stages = {}
+        for record in self.records:
+            summary = stages.setdefault(record["stage"], {"calls": 0, "seconds": 0.0, "bytesRead": 0,
+                                                          "bytesWritten": 0, "spectra": 0, "bins": 0,
+                                                          "maxRssChangeMB": None, "maxPeakRssIncreaseMB": 0.0,
+                                                          "processPeakRssMB": 0.0})
+            summary["calls"] += 1
+            for key in ("seconds", "bytesRead", "bytesWritten", "spectra"):
+                summary[key] += record[key]
+            summary["bins"] += record["spectra"] * record["bins"]
+            # the largest of each over the calls of the stage
+            change = record["rssChangeMB"]
+            if change is not None and (summary["maxRssChangeMB"] is None or change > summary["maxRssChangeMB"]):
+                summary["maxRssChangeMB"] = change
+            summary["maxPeakRssIncreaseMB"] = max(summary["maxPeakRssIncreaseMB"], record["peakRssIncreaseMB"])
+            summary["processPeakRssMB"] = max(summary["processPeakRssMB"], record["processPeakRssMB"])
+        for summary in stages.values():
+            if summary["seconds"] > 0:
+                summary["spectraPerSecond"] = summary["spectra"] / summary["seconds"]
+                summary["binsPerSecond"] = summary["bins"] / summary["seconds"]
+                summary["megabytesPerSecond"] = (summary["bytesRead"] + summary["bytesWritten"]) / summary["seconds"] / 1e6
+        return stages
+
+    def writeReport(self, filename):
+        '''
+        Writes the per stage totals and every record as JSON. If a stage was run under cProfile its statistics,
+        merged over this process and the pool workers, are dumped next to the report as <filename>.<stage>.prof.
+        Nothing is dumped if the stage never ran.
+        :param filename: JSON file for the report
+        '''
+        with open(filename, "w") as f:
+            json.dump({"stages": self._summarise(), "records": self.records}, f, indent=1, sort_keys=True)
+        self.addStats(self.popStats())
+        if len(self.cProfileStats) > 0:
+            stats = pstats.Stats(*[_CollectedStats(stats) for stats in self.cProfileStats])
+            stats.dump_stats(filename + "." + self.cProfileStage + ".prof")
+
+
+# shared by all modules so that a single switch in ConvertData.py instruments the whole conversion
+profiler = StageProfiler()
@@ -0,0 +1,99 @@
+import math
+import numpy
+
+
+def parseParams(text):
+    '''
+    :param text: Comma separated rebin parameters, e.g. "1000,10,50000"
+    :return: List of floats
+    '''
+    return [float(value) for value in text.split(",")]
+
+
+class Rebinner(object):
+    '''
+    Rebins the counts of every spectrum onto new TOF bins at once. Rebin parameters follow Mantid's Rebin: x1,dx1,x2
+    or x1,dx1,x2,dx2,x3 and so on, where a negative dx gives logarithmic bins with each bin |dx| times wider than the
+    one before. Counts are redistributed by linear interpolation of the cumulative counts at the new bin edges, which
+    conserves the counts inside the new range. Edges are in microseconds, the units of the TOF axis from TofReader.
+    '''
+
+    def __init__(self, params):
+        '''
+        Constructor
+        :param params: Rebin parameters in microseconds
+        '''
+        self.params = params
+        self.edges = self._makeEdges(params)
+        self.plans = {}
+
+    def _makeEdges(self, params):
+        '''
+        :param params: Rebin parameters
+        :return: The new bin edges
+        '''
+        if len(params) < 3 or len(params) % 2 == 0:
+            raise ValueError("Rebin parameters must be x1,dx1,x2 optionally followed by further dx,x pairs, got " +
+                             ",".join(str(p) for p in params))
+
+        params = [float(p) for p in params] # integer parameters would divide as integers
+        edges = []
+        for i in xrange(0, len(params) - 1, 2):
+            x1, dx, x2 = params[i:i + 3]
+            if x2 <= x1 or dx == 0:
+                raise ValueError("Invalid rebin range " + str(x1) + "," + str(dx) + "," + str(x2))
+            if dx > 0:
+                # the tolerance keeps rounding from adding a sliver of a bin before x2
+                numBins = int(math.ceil((x2 - x1) / dx - 1e-9))
+                edges.append(x1 + dx * numpy.arange(numBins))
+            else:
+                if x1 <= 0:
+                    raise ValueError("Logarithmic bins must start above zero, got " + str(x1))
+                numBins = int(math.ceil(math.log(x2 / x1) / math.log(1 - dx) - 1e-9))
+                edges.append(x1 * (1 - dx) ** numpy.arange(numBins))
+        edges.append([params[-1]])
+        return numpy.concatenate(edges)
+
+    def _sourceEdges(self, tof):
+        '''
+        The TOF values of the *.toff files are points, the edges of their bins are taken halfway between neighbouring
+        points and half a bin beyond the first and last points.
+        :param tof: TOF values of a run
+        :return: Bin edges of the run
+        '''
+        if len(tof) < 2 or (numpy.diff(tof) <= 0).any():
+            raise ValueError("TOF values must be increasing and at least two to be rebinned")
+        midpoints = (tof[:-1] + tof[1:]) / 2.0
+        return numpy.concatenate(([2 * tof[0] - midpoints[0]], midpoints, [2 * tof[-1] - midpoints[-1]]))
+
+    def _plan(self, tof):
+        '''
+        Locates the new edges in the bins of the run once per binning. New edges which miss the bins of the run
+        altogether are rejected, rather than every count being dropped.
+        :param tof: TOF values of a run
+        :return: Index of the run's bin each new edge falls in and the fraction of that bin below the edge
+        '''
+        key = tof.tostring()
+        if key not in self.plans:
+            source = self._sourceEdges(tof)
+            if self.edges[-1] <= source[0] or self.edges[0] >= source[-1]:
+                raise ValueError("The rebin range " + str(self.edges[0]) + " to " + str(self.edges[-1]) +
+                                 " microseconds does not overlap the TOF range " + str(source[0]) + " to " +
+                                 str(source[-1]) + " microseconds of the run")
+            index = numpy.clip(numpy.searchsorted(source, self.edges, side="right") - 1, 0, len(tof) - 1)
+            fraction = numpy.clip((self.edges - source[index]) / (source[index + 1] - source[index]), 0.0, 1.0)
+            self.plans[key] = (index, fraction)
+        return self.plans[key]
+
+    def rebin(self, tof, counts):
+        '''
+        :param tof: TOF values of a run
+        :param counts: Dense counts with one row per spectrum
+        :return: The new bin edges and the rebinned counts
+        '''
+        index, fraction = self._plan(tof)
+        cumulative = numpy.empty((counts.shape[0], counts.shape[1] + 1))
+        cumulative[:, 0] = 0
+        numpy.cumsum(counts, axis=1, dtype=float, out=cumulative[:, 1:])
+        atEdges = cumulative[:, index] * (1 - fraction) + cumulative[:, index + 1] * fraction
+        return self.edges, numpy.diff(atEdges, axis=1)
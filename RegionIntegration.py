@@ -0,0 +1,191 @@
+import csv
+import json
+import numpy
+import CompactCounts
+import ExtractGeometry
+import FileCache
+import GenerateIDF
+import Profiling
+
+
+class RegionIntegrator(object):
+    '''
+    Integrates the counts of runs over regions of the detector. The regions are read from a JSON file as a list of
+    objects, each with a name and one of the shapes
+        {"name": "ring", "shape": "annulus", "centre": [x, y], "radii": [rmin, rmax]}
+        {"name": "wedge", "shape": "sector", "centre": [x, y], "radii": [rmin, rmax], "angles": [phimin, phimax]}
+        {"name": "box", "shape": "rectangle", "x": [xmin, xmax], "y": [ymin, ymax]}
+    in metres in the plane of the detectors, in the frame of LOKI_pixels.npy with the beam at the origin. Angles are
+    in degrees anticlockwise from the x axis. The fraction of each pad inside each region is found once by sampling
+    the pad polygon on a grid and kept as a sparse weight matrix, so integrating a run is a single sparse product.
+    '''
+
+    # increment when the weights change so that old cache entries are not used
+    version = 1
+
+    def __init__(self, regionFile, coordinateFile, detectorMapFile, cacheFolder=None, supersampling=8):
+        '''
+        Constructor
+        :param regionFile: JSON file which defines the regions
+        :param coordinateFile: File which contains the engineering coordinates for detector pads
+        :param detectorMapFile: Detector map written by LOKIGenerator, from physical IDs to IDF detector IDs
+        :param cacheFolder: Optional folder in which the geometry and the weights are cached, keyed by the content hash
+        of the coordinate, map and region files. None disables the cache.
+        :param supersampling: Number of samples along each side of a pad
+        '''
+        self.regionFile = regionFile
+        self.coordinateFile = coordinateFile
+        self.detectorMapFile = detectorMapFile
+        self.cache = FileCache.FileCache(cacheFolder)
+        self.supersampling = supersampling
+        self.names = None
+        self.indptr = None
+        self.columns = None
+        self.weights = None
+
+    def _loadRegions(self):
+        with open(self.regionFile, "r") as f:
+            regions = json.load(f)
+        shapes = {"annulus": ("centre", "radii"), "sector": ("centre", "radii", "angles"), "rectangle": ("x", "y")}
+        for i, region in enumerate(regions):
+            if region.get("shape") not in shapes:
+                raise ValueError("Region " + str(i) + " in " + self.regionFile + " has an unknown shape, must be one "
+                                 "of " + ", ".join(sorted(shapes)))
+            missing = [key for key in shapes[region["shape"]] if len(region.get(key, [])) != 2]
+            if len(missing) > 0:
+                raise ValueError("Region " + str(i) + " in " + self.regionFile + " needs a pair of values for " +
+                                 ", ".join(missing))
+            region.setdefault("name", "region" + str(i))
+        return regions
+
+    def _contains(self, region, x, y):
+        '''
+        :return: Whether each point lies in the region
+        '''
+        if region["shape"] == "rectangle":
+            return (x >= region["x"][0]) & (x < region["x"][1]) & (y >= region["y"][0]) & (y < region["y"][1])
+
+        dx = x - region["centre"][0]
+        dy = y - region["centre"][1]
+        r2 = dx * dx + dy * dy
+        inside = (r2 >= region["radii"][0] ** 2) & (r2 < region["radii"][1] ** 2)
+        if region["shape"] == "sector":
+            # angles are measured from the start of the sector so that sectors may cross +-180 degrees
+            width = (region["angles"][1] - region["angles"][0]) % 360.0
+            inside &= (numpy.degrees(numpy.arctan2(dy, dx)) - region["angles"][0]) % 360.0 < width
+        return inside
+
+    def _padSamples(self, extractor):
+        '''
+        Samples every pad at the centres of a grid over the unit square mapped bilinearly onto the pad polygon.
+        :return: Sample positions relative to the pad coordinate frame in metres, each of shape (pads, samples), and
+        the area each sample stands for
+        '''
+        pads = numpy.arange(len(extractor.x))[:, numpy.newaxis]
+        cx = extractor.x[pads, extractor.cornerOrder] / 1000.0
+        cy = extractor.y[pads, extractor.cornerOrder] / 1000.0
+
+        steps = (numpy.arange(self.supersampling) + 0.5) / self.supersampling
+        u, v = [grid.ravel()[numpy.newaxis, :] for grid in numpy.meshgrid(steps, steps)]
+        corners = [(cx[:, i:i + 1], cy[:, i:i + 1]) for i in xrange(4)]
+        shape = [(1 - u) * (1 - v), u * (1 - v), u * v, (1 - u) * v]
+        x = sum(s * c[0] for s, c in zip(shape, corners))
+        y = sum(s * c[1] for s, c in zip(shape, corners))
+
+        # the bilinear map stretches trapezoids unevenly so each sample is weighted by its Jacobian
+        (x0, y0), (x1, y1), (x2, y2), (x3, y3) = corners
+        dxdu, dydu = (1 - v) * (x1 - x0) + v * (x2 - x3), (1 - v) * (y1 - y0) + v * (y2 - y3)
+        dxdv, dydv = (1 - u) * (x3 - x0) + u * (x2 - x1), (1 - u) * (y3 - y0) + u * (y2 - y1)
+        return x, y, numpy.abs(dxdu * dydv - dydu * dxdv)
+
+    def _mappedPads(self, extractor):
+        '''
+        :return: For each row of the detector map which is a pad: the pad's index in the extractor, its IDF detector ID
+        and its bank
+        '''
+        with open(self.detectorMapFile, "rb") as f:
+            mapTable = numpy.array(list(csv.reader(f, delimiter=","))).astype(int)
+        physicalIds = mapTable[:, 0]
+        bank = GenerateIDF.LOKIGenerator.mapBanks(physicalIds)
+
+        sortedIDs = numpy.argsort(extractor.detIDs)
+        position = numpy.clip(numpy.searchsorted(extractor.detIDs[sortedIDs], physicalIds), 0, len(sortedIDs) - 1)
+        isPad = extractor.detIDs[sortedIDs][position] == physicalIds # drops the monitor
+        return sortedIDs[position][isPad], mapTable[isPad, 1], bank[isPad]
+
+    def _buildWeights(self):
+        regions = self._loadRegions()
+        extractor = ExtractGeometry.GeometryExtractor(self.coordinateFile, self.cache.folder)
+        extractor.extract()
+        pads, ids, bank = self._mappedPads(extractor)
+        x, y, area = self._padSamples(extractor)
+
+        # place the pads of each bank as LOKIGenerator does, offset from the beam then rotated about it
+        y = y + extractor.getPosOffset() / 1000.0
+        angles = numpy.radians(GenerateIDF.LOKIGenerator.firstBankAngle +
+                               GenerateIDF.LOKIGenerator.bankAngleStep * bank)[:, numpy.newaxis]
+        x, y, area = x[pads], y[pads], area[pads]
+        x, y = x * numpy.cos(angles) - y * numpy.sin(angles), x * numpy.sin(angles) + y * numpy.cos(angles)
+        totalArea = area.sum(axis=1)
+
+        columns = []
+        weights = []
+        for region in regions:
+            fraction = (area * self._contains(region, x, y)).sum(axis=1) / totalArea
+            overlapping = numpy.flatnonzero(fraction > 0)
+            columns.append(ids[overlapping])
+            weights.append(fraction[overlapping])
+        indptr = numpy.cumsum([0] + [len(c) for c in columns])
+        return {"names": numpy.array([region["name"] for region in regions]), "indptr": indptr,
+                "columns": numpy.concatenate(columns), "weights": numpy.concatenate(weights)}
+
+    def load(self):
+        '''
+        Loads the weight matrix from the cache or builds it.
+        '''
+        if self.weights is not None:
+            return
+        key = self.cache.hashFiles([self.coordinateFile, self.detectorMapFile, self.regionFile],
+                                   "RegionIntegrator" + str(self.version) + "_" + str(self.supersampling))
+        entry = self.cache.load("regions", key)
+        if entry is None:
+            with Profiling.profiler.stage("buildRegionWeights", self.regionFile):
+                entry = self._buildWeights()
+            self.cache.save("regions", key, **entry)
+
+        self.names = [str(name) for name in entry["names"]]
+        self.indptr = entry["indptr"]
+        self.columns = entry["columns"]
+        self.weights = entry["weights"]
+        for name, start, stop in zip(self.names, self.indptr[:-1], self.indptr[1:]):
+            if start == stop:
+                print "Region ", name, " does not overlap any pad"
+
+    def integrate(self, counts):
+        '''
+        :param counts: Dense or compact counts with one row per spectrum, spectrum i being IDF detector ID i
+        :return: Counts of each region with one row per region
+        '''
+        if len(self.columns) > 0 and self.columns.max() >= counts.shape[0]:
+            raise ValueError("The regions cover detector ID " + str(self.columns.max()) + " but there are only " +
+                             str(counts.shape[0]) + " spectra")
+        weighted = CompactCounts.expand(CompactCounts.takeRows(counts, self.columns))
+        weighted *= self.weights[:, numpy.newaxis]
+
+        result = numpy.zeros((len(self.names), counts.shape[1]))
+        nonEmpty = self.indptr[:-1] < self.indptr[1:]
+        if nonEmpty.any():
+            result[nonEmpty] = numpy.add.reduceat(weighted, self.indptr[:-1][nonEmpty], axis=0)
+        return result
+
+    def write(self, outfile, tof, intensities):
+        '''
+        Writes the counts of each region against TOF, with the bin centres for histograms.
+        :param outfile: CSV file to write
+        :param tof: TOF values or bin edges
+        :param intensities: Counts of each region as returned by integrate
+        '''
+        if len(tof) == intensities.shape[1] + 1:
+            tof = (tof[:-1] + tof[1:]) / 2.0
+        numpy.savetxt(outfile, numpy.column_stack((tof, intensities.T)), delimiter=",",
+                      header=",".join(["tof"] + self.names))
@@ -0,0 +1,120 @@
+import itertools
+import numpy
+import CompactCounts
+
+
+class TofReader(object):
+    '''
+    Reader for the tab separated *.toff files. The first row holds the time of flight values, every following row
+    holds the detector ID followed by the counts in each TOF bin. Every row ends with a tab so the last column is empty.
+    '''
+
+    # size of the blocks of text parsed at a time, so the text of a whole run is never held
+    blockBytes = 1 << 20
+
+    def __init__(self, filename):
+        '''
+        Constructor
+        :param filename: The *.toff file to read
+        '''
+        self.filename = filename
+
+    def _parseHeader(self, header):
+        '''
+        Converts the header row into TOF values. The file holds nanoseconds.
+        :param header: First line of the file
+        :return: TOF values in microseconds
+        '''
+        tof = header.rstrip("\r\n").split("\t")
+        del tof[0] # column 0 is the detector id
+        del tof[-1] # the last column contains nothing.
+        return numpy.array(tof).astype(float) / 1000.0
+
+    def scan(self):
+        '''
+        Reads the header and counts the rows without parsing the counts. Blank lines at the end of the file are not
+        counted as rows.
+        :return: TOF values, the number of rows after the header and the number of columns in the first of them
+        '''
+        with open(self.filename, "rb") as f:
+            tof = self._parseHeader(f.readline())
+            firstRow = f.readline()
+            numNewlines = 0
+            trailing = "" # whitespace after the last value read so far
+            hasRows = False
+            for block in itertools.chain([firstRow], iter(lambda: f.read(1 << 20), "")):
+                numNewlines += block.count("\n")
+                stripped = block.rstrip()
+                if len(stripped) > 0:
+                    trailing = block[len(stripped):]
+                    hasRows = True
+                else:
+                    trailing += block
+
+        # the newlines after the last value end the last row and any blank lines, the last row may have no newline
+        numRows = numNewlines - trailing.count("\n") + 1 if hasRows else 0
+        return tof, numRows, len(firstRow.rstrip("\r\n").split("\t"))
+
+    def _blocks(self, f, numCols):
+        '''
+        Parses the numeric block of the file a block of whole rows at a time. The text of each block is read into memory
+        and parsed with numpy.fromstring, which unlike numpy.fromfile does not lock the file for every character it
+        reads and so does not slow down when other threads are running, as they are in mantidpython.
+        :param f: The file, positioned after the header
+        :param numCols: Number of values in each row
+        :return: Iterator over float arrays with one row per line
+        '''
+        for text in iter(lambda: f.read(self.blockBytes), ""):
+            text += f.readline() # complete the last row of the block
+            if text.isspace():
+                continue # numpy.fromstring reads whitespace alone as -1
+            # whitespace in the separator matches any run of tabs and newlines, so the empty last column is skipped
+            values = numpy.fromstring(text, sep=" ")
+            if values.size % numCols != 0:
+                raise ValueError("Malformed toff file " + self.filename + ": " + str(values.size) +
+                                 " values do not fill rows of " + str(numCols) + " columns")
+            yield values.reshape(-1, numCols)
+
+    def load(self, numRows=None, compact=False):
+        '''
+        Parses the numeric block of the file into one array, the rows are not converted through intermediate lists of
+        strings.
+        :param numRows: Optional number of rows after the header, e.g. from scan, so the array is allocated at its exact
+        size
+        :param compact: If True the counts are compacted a block of rows at a time as they are parsed with
+        CompactCounts.CompactBuilder, so the float counts of the whole file are only held if they are not whole numbers
+        :return: TOF values, the detector ID column and the counts with one row per line in the file
+        '''
+        with open(self.filename, "rb") as f:
+            tof = self._parseHeader(f.readline())
+            numCols = len(tof) + 1 # the detector id precedes the counts
+            if compact:
+                builder = CompactCounts.CompactBuilder(len(tof), numRows)
+                ids = []
+            elif numRows is not None:
+                data = numpy.empty((numRows, numCols))
+            else:
+                blocks = []
+
+            row = 0
+            for block in self._blocks(f, numCols):
+                if numRows is not None and row + len(block) > numRows:
+                    row += len(block)
+                    break
+                if compact:
+                    ids.append(block[:, 0].astype(int))
+                    builder.add(block[:, 1:])
+                elif numRows is not None:
+                    data[row:row + len(block)] = block
+                else:
+                    blocks.append(block)
+                row += len(block)
+            if numRows is not None and row != numRows:
+                raise ValueError("Malformed toff file " + self.filename + ": expected " + str(numRows) + " rows of " +
+                                 str(numCols) + " columns but read " + ("more" if row > numRows else str(row)))
+
+        if compact:
+            return tof, numpy.concatenate([numpy.zeros(0, dtype=int)] + ids), builder.result()
+        if numRows is None:
+            data = numpy.concatenate([numpy.zeros((0, numCols))] + blocks)
+        return tof, data[:, 0].astype(int), data[:, 1:]
@@ -0,0 +1,139 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+import BatchIndex
+
+
+def _writeToff(folder, name, numRows=4, tof=(1000, 2000, 3000), numValues=None):
+    '''
+    Writes a *.toff file with the given rows and TOF values.
+    :param numValues: Optional number of counts in each row, if it should not match the TOF values
+    :return: The file
+    '''
+    numValues = len(tof) if numValues is None else numValues
+    filename = os.path.join(folder, name)
+    with open(filename, "w") as f:
+        f.write("ID\t" + "".join(str(t) + "\t" for t in tof) + "\n")
+        for row in xrange(numRows):
+            f.write(str(row) + "\t" + "1\t" * numValues + "\n")
+    return filename
+
+
+class BatchIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _write(self, name, **options):
+        return _writeToff(self.folder, name, **options)
+
+    def testValidFiles(self):
+        files = [self._write("a.toff"), self._write("b.toff", numRows=6)]
+        index = BatchIndex.BatchIndex(files)
+        self.assertEqual(index.problems, {})
+        self.assertEqual(index.numRows(files[1]), 6)
+        self.assertEqual(index.entries[files[0]]["bins"], 3)
+        self.assertEqual(index.entries[files[0]]["tofMax"], 3.0)
+        self.assertEqual(index.summary(), "Indexed 2 files: 2 valid in 1 binning group(s), 0 invalid")
+
+    def testMalformedFiles(self):
+        noTof = self._write("noTof.toff", tof=())
+        wrongColumns = self._write("wrongColumns.toff", numValues=2)
+        missing = os.path.join(self.folder, "missing.toff")
+        index = BatchIndex.BatchIndex([noTof, wrongColumns, missing, self._write("good.toff")])
+        self.assertEqual(sorted(index.problems), [missing, noTof, wrongColumns])
+        self.assertIn("no TOF values", index.problems[noTof])
+        self.assertIn("has 5 columns but the first row has 4", index.problems[wrongColumns])
+        self.assertTrue(index.problems[missing].startswith("IOError"))
+        self.assertEqual(len(index.entries), 1)
+
+    def testValidate(self):
+        short = self._write("short.toff", numRows=3)
+        good = self._write("good.toff", numRows=4)
+        index = BatchIndex.BatchIndex([short, good])
+        index.validate(numpy.array([0, 1, 3]))
+        self.assertEqual(list(index.entries), [good])
+        self.assertEqual(index.problems[short], "File " + short + " has 3 detector rows but detector ID 3 is valid")
+
+    def testScheduledByBinning(self):
+        files = [self._write("a.toff"), self._write("b.toff", tof=(1000, 2000)), self._write("c.toff"),
+                 self._write("d.toff", tof=(1000, 2000))]
+        index = BatchIndex.BatchIndex(files)
+        self.assertEqual(index.scheduled(), [files[0], files[2], files[1], files[3]])
+        self.assertEqual(index.summary(), "Indexed 4 files: 4 valid in 2 binning group(s), 0 invalid")
+
+
+class GroupBanksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.runs = {}
+        self.files = []
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _writeRun(self, run, banks, **options):
+        '''
+        Writes a file for each of the given banks of a run, which is keyed by the file of its first bank as _listRuns
+        of ConvertLokiRuns keys it.
+        :param options: Options of _writeToff for the last of the banks
+        :return: The file of the first bank
+        '''
+        files = [None] * (max(banks) + 1)
+        for bank in banks:
+            name = run + "_bank" + str(bank) + ".toff"
+            files[bank] = _writeToff(self.folder, name, **(options if bank == banks[-1] else {}))
+        self.runs[files[banks[0]]] = files
+        self.files += [f for f in files if f is not None]
+        return files[banks[0]]
+
+    def _index(self, numBanks=2):
+        index = BatchIndex.BatchIndex(self.files)
+        index.groupBanks(self.runs, numBanks)
+        return index
+
+    def testCompleteRun(self):
+        run = self._writeRun("run0", [0, 1], numRows=6)
+        index = self._index()
+        self.assertEqual(index.problems, {})
+        self.assertEqual(list(index.entries), [run])
+        # the row counts of every bank are kept for parsing
+        self.assertEqual(index.numRows(self.runs[run][1]), 6)
+
+    def testMissingBank(self):
+        self._writeRun("run0", [0, 1])
+        incomplete = self._writeRun("run1", [0])
+        index = self._index()
+        self.assertEqual(len(index.entries), 1)
+        self.assertEqual(index.problems, {incomplete: "Run " + incomplete + " has files for banks 0 but the detector "
+                                                      "map has 2 bank(s)"})
+
+    def testMissingFirstBank(self):
+        run = self._writeRun("run0", [1])
+        index = self._index()
+        self.assertEqual(index.entries, {})
+        self.assertEqual(index.problems, {run: "Run " + run + " has files for banks 1 but the detector map has 2 "
+                                               "bank(s)"})
+
+    def testInvalidBank(self):
+        run = self._writeRun("run0", [0, 1], numValues=2)
+        index = self._index()
+        self.assertEqual(index.entries, {})
+        self.assertEqual(list(index.problems), [run])
+        self.assertIn("run0_bank1.toff", index.problems[run])
+
+    def testBanksWithDifferentBinning(self):
+        run = self._writeRun("run0", [0, 1], tof=(1000, 2000))
+        index = self._index()
+        self.assertEqual(index.entries, {})
+        self.assertEqual(index.problems, {run: "The banks of run " + run + " do not all have the same binning"})
+
+
+if __name__ == "__main__":
+    unittest.main()
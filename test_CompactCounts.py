@@ -0,0 +1,121 @@
+import unittest
+import numpy
+import CompactCounts
+
+
+class CompactCountsTest(unittest.TestCase):
+
+    def setUp(self):
+        random = numpy.random.RandomState(0)
+        self.sparse = ((random.rand(50, 30) < 0.05) * random.randint(1, 300, (50, 30))).astype(float)
+        self.sparse[7] = 0 # an empty row
+        self.dense = random.poisson(3.0, (50, 30)).astype(float)
+        self.rows = numpy.array([3, 7, 7, 0, 49, 12])
+
+    def _layouts(self):
+        return [self.sparse, CompactCounts.compact(self.sparse), self.dense, CompactCounts.compact(self.dense)]
+
+    def testLayouts(self):
+        sparse = CompactCounts.compact(self.sparse)
+        self.assertIsInstance(sparse, CompactCounts.SparseCounts)
+        self.assertEqual(sparse.data.dtype, numpy.uint16)
+        self.assertEqual(sparse.shape, self.sparse.shape)
+        dense = CompactCounts.compact(self.dense)
+        self.assertEqual(dense.dtype, numpy.uint8)
+
+        fractional = self.dense.copy()
+        fractional[40, 3] = 0.5
+        self.assertIs(CompactCounts.compact(fractional), fractional)
+        negative = self.sparse.copy()
+        negative[45, 0] = -1
+        self.assertIs(CompactCounts.compact(negative), negative)
+
+    def testCompactInBlocks(self):
+        for blockRows in (1, 7, 50):
+            numpy.testing.assert_array_equal(
+                CompactCounts.expand(CompactCounts.compact(self.sparse, blockRows=blockRows)), self.sparse)
+            numpy.testing.assert_array_equal(
+                CompactCounts.expand(CompactCounts.compact(self.dense, blockRows=blockRows)), self.dense)
+
+    def testToDense(self):
+        sparse = CompactCounts.compact(self.sparse)
+        numpy.testing.assert_array_equal(sparse.toDense(), self.sparse)
+        numpy.testing.assert_array_equal(sparse.toDense(5, 20), self.sparse[5:20])
+        out = numpy.ones((15, 30))
+        sparse.toDense(5, 20, out=out)
+        numpy.testing.assert_array_equal(out, self.sparse[5:20])
+
+    def testArrays(self):
+        for counts in self._layouts():
+            numpy.testing.assert_array_equal(
+                CompactCounts.expand(CompactCounts.fromArrays(CompactCounts.toArrays(counts))),
+                CompactCounts.expand(counts))
+
+    def testTakeRows(self):
+        for counts, expected in zip(self._layouts(), [self.sparse] * 2 + [self.dense] * 2):
+            numpy.testing.assert_array_equal(CompactCounts.expand(CompactCounts.takeRows(counts, self.rows)),
+                                             expected[self.rows])
+
+    def testTakeRowsInto(self):
+        for counts, expected in zip(self._layouts(), [self.sparse] * 2 + [self.dense] * 2):
+            for dtype in (float, numpy.uint16):
+                out = numpy.ones((len(self.rows) + 2, 30), dtype=dtype)
+                CompactCounts.takeRowsInto(out[1:-1], counts, self.rows)
+                numpy.testing.assert_array_equal(out[1:-1], expected[self.rows])
+                numpy.testing.assert_array_equal(out[[0, -1]], numpy.ones((2, 30)))
+
+    def testAddTo(self):
+        for counts, expected in zip(self._layouts(), [self.sparse] * 2 + [self.dense] * 2):
+            total = numpy.ones((50, 30))
+            CompactCounts.addTo(total, counts)
+            numpy.testing.assert_array_equal(total, expected + 1)
+
+
+class CompactBuilderTest(unittest.TestCase):
+
+    def setUp(self):
+        random = numpy.random.RandomState(1)
+        self.counts = ((random.rand(100, 20) < 0.1) * random.randint(1, 1000, (100, 20))).astype(float)
+
+    def _build(self, counts, blockRows, numRows=None):
+        builder = CompactCounts.CompactBuilder(counts.shape[1], numRows)
+        for start in xrange(0, counts.shape[0], blockRows):
+            builder.add(counts[start:start + blockRows])
+        return builder.result()
+
+    def testSparseBlocks(self):
+        result = self._build(self.counts, 9)
+        self.assertIsInstance(result, CompactCounts.SparseCounts)
+        self.assertEqual(result.data.dtype, numpy.uint16)
+        numpy.testing.assert_array_equal(result.toDense(), self.counts)
+
+    def testLayoutChosenFromTotals(self):
+        # the first blocks are dense and the rest empty, so the run as a whole is sparse
+        counts = numpy.zeros((100, 20))
+        counts[:10] = 1
+        result = self._build(counts, 10)
+        self.assertIsInstance(result, CompactCounts.SparseCounts)
+        numpy.testing.assert_array_equal(result.toDense(), counts)
+
+        # the first blocks are sparse and the rest dense, so the run as a whole is dense
+        counts = numpy.ones((100, 20))
+        counts[:10] = 0
+        result = self._build(counts, 10)
+        self.assertEqual(result.dtype, numpy.uint8)
+        numpy.testing.assert_array_equal(result, counts)
+
+    def testFloatsAfterWholeBlocks(self):
+        counts = self.counts.copy()
+        counts[95, 4] = 2.5
+        for numRows in (None, 100):
+            result = self._build(counts, 9, numRows)
+            self.assertEqual(result.dtype, float)
+            numpy.testing.assert_array_equal(result, counts)
+
+    def testEmpty(self):
+        result = CompactCounts.CompactBuilder(20).result()
+        self.assertEqual(result.shape, (0, 20))
+
+
+if __name__ == "__main__":
+    unittest.main()
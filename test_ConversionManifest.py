@@ -0,0 +1,95 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+import ConversionManifest
+
+
+class ConversionManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.infile = self._write("run.toff", "1\t2\t3\n")
+        self.outfile = self._write("run.nxs", "")
+        self.versions = {"idf": "a", "map": "b"}
+        self.hashed = []
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _write(self, name, contents, mtime=None):
+        filename = os.path.join(self.folder, name)
+        with open(filename, "w") as f:
+            f.write(contents)
+        if mtime is not None:
+            os.utime(filename, (mtime, mtime))
+        return filename
+
+    def _hash(self, infile):
+        self.hashed.append(infile)
+        with open(infile, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    def _recorded(self):
+        manifest = ConversionManifest.ConversionManifest(self.folder)
+        manifest.record(self.infile, self.outfile, self.versions, self._hash(self.infile))
+        self.hashed = []
+        return manifest
+
+    def _isUpToDate(self, manifest, versions=None):
+        return manifest.isUpToDate(self.infile, self.outfile, versions or self.versions, self._hash)
+
+    def testNewRun(self):
+        manifest = ConversionManifest.ConversionManifest(self.folder)
+        self.assertFalse(self._isUpToDate(manifest))
+
+    def testRecordedRunSkippedWithoutHashing(self):
+        self._recorded()
+        # the manifest is read back from the output folder
+        manifest = ConversionManifest.ConversionManifest(self.folder)
+        self.assertTrue(self._isUpToDate(manifest))
+        self.assertEqual(self.hashed, [])
+
+    def testMissingOutput(self):
+        manifest = self._recorded()
+        os.remove(self.outfile)
+        self.assertFalse(self._isUpToDate(manifest))
+
+    def testChangedVersions(self):
+        manifest = self._recorded()
+        self.assertFalse(self._isUpToDate(manifest, {"idf": "c", "map": "b"}))
+
+    def testTouchedRunRehashedOnce(self):
+        manifest = self._recorded()
+        os.utime(self.infile, (1e9, 1e9))
+        self.assertTrue(self._isUpToDate(manifest))
+        self.assertEqual(self.hashed, [self.infile])
+        # the new modification time is kept so the run is not hashed again
+        self.assertTrue(self._isUpToDate(manifest))
+        self.assertEqual(self.hashed, [self.infile])
+
+    def testChangedContentsOfSameSize(self):
+        manifest = self._recorded()
+        self._write("run.toff", "1\t2\t4\n", mtime=1e9)
+        self.assertFalse(self._isUpToDate(manifest))
+        self.assertEqual(self.hashed, [self.infile])
+
+    def testChangedSizeNotHashed(self):
+        manifest = self._recorded()
+        self._write("run.toff", "1\t2\t3\t4\n", mtime=1e9)
+        self.assertFalse(self._isUpToDate(manifest))
+        self.assertEqual(self.hashed, [])
+
+    def testRunWithSeveralSources(self):
+        bank1 = self._write("run_bank1.toff", "5\t6\n")
+        sources = [self.infile, bank1]
+        manifest = ConversionManifest.ConversionManifest(self.folder)
+        manifest.record(self.infile, self.outfile, self.versions, "hash", sources)
+        self.assertTrue(manifest.isUpToDate(self.infile, self.outfile, self.versions, self._hash, sources))
+        self._write("run_bank1.toff", "5\t6\t7\n")
+        self.assertFalse(manifest.isUpToDate(self.infile, self.outfile, self.versions, self._hash, sources))
+
+
+if __name__ == "__main__":
+    unittest.main()
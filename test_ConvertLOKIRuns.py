@@ -0,0 +1,341 @@
+import csv
+import os
+import pstats
+import shutil
+import tempfile
+import threading
+import unittest
+import numpy
+import Benchmark
+import CompactCounts
+import ConvertLOKIRuns
+import FileCache
+import GenerateIDF
+import Profiling
+import TofReader
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+class SyntheticRunsTestBase(unittest.TestCase):
+    '''
+    Writes a small synthetic layout with its IDF and detector map and synthetic runs into a temporary folder.
+    '''
+    banks = 1
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.data = Benchmark.SyntheticData(self.folder, components=2, rowsPerComponent=3, padsPerRow=4, dummies=5)
+        self.coordinateFile = self.data.writeCoordinates()
+        cwd = os.getcwd()
+        os.chdir(self.folder)
+        try:
+            GenerateIDF.LOKIGenerator(self.coordinateFile, self.banks).generate()
+        finally:
+            os.chdir(cwd)
+        self.idf = os.path.join(self.folder, "LOKI_BANDGEM_definition.xml")
+        self.mapFile = os.path.join(self.folder, "LOKI_map.csv")
+        self.runFolder = self.data.writeRuns(3, 20, self.banks)
+        self.outFolder = os.path.join(self.folder, "out")
+        os.makedirs(self.outFolder)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _converter(self, **options):
+        options.setdefault("cacheFolder", None)
+        return ConvertLOKIRuns.ConvertLokiRuns(self.runFolder, self.coordinateFile, self.idf, self.mapFile,
+                                               self.outFolder, backend="h5py", **options)
+
+    def _mapTable(self):
+        with open(self.mapFile, "rb") as f:
+            return numpy.array(list(csv.reader(f, delimiter=","))).astype(int)
+
+
+class SpectrumOrderTest(unittest.TestCase):
+    '''
+    Detector IDs 0, 2 and 3 with the monitor 5, mapped onto two banks of three spectra.
+    '''
+
+    def setUp(self):
+        self.converter = ConvertLOKIRuns.ConvertLokiRuns("data", "coordinate.txt", "idf.xml", "map.csv",
+                                                         cacheFolder=None)
+        self.validIDs = numpy.array([0, 2, 3, 5])
+        self.mapTable = numpy.array([[3, 0], [0, 1], [2, 2], [3, 3], [0, 4], [2, 5], [5, 6]])
+
+    def _assertRejected(self, mapTable):
+        self.assertRaises(ValueError, self.converter._buildSpectrumOrder, self.validIDs, numpy.array(mapTable))
+
+    def testValidMap(self):
+        order, numBanks = self.converter._buildSpectrumOrder(self.validIDs, self.mapTable)
+        self.assertEqual(numBanks, 2)
+        numpy.testing.assert_array_equal(order, [3, 0, 2, 3, 0, 2, 5])
+
+    def testWithoutMap(self):
+        order, numBanks = self.converter._buildSpectrumOrder(self.validIDs, numpy.zeros((0, 2), dtype=int))
+        self.assertEqual(numBanks, 1)
+        numpy.testing.assert_array_equal(order, self.validIDs)
+
+    def testMonitorMustBeMappedOnce(self):
+        self._assertRejected(self.mapTable[:-1])
+        self._assertRejected(numpy.vstack((self.mapTable, [[5, 6]])))
+
+    def testMonitorMustBeLastSpectrum(self):
+        mapTable = self.mapTable.copy()
+        mapTable[-1, 1] = 7
+        self._assertRejected(mapTable)
+
+    def testEveryDetectorInEveryBank(self):
+        mapTable = self.mapTable.copy()
+        mapTable[3, 0] = 2 # detector 3 missing from bank 1, detector 2 twice
+        self._assertRejected(mapTable)
+        self._assertRejected(self.mapTable[[0, 1, 2, 3, 4, 6]])
+
+    def testSpectraMustBeOneToOne(self):
+        mapTable = self.mapTable.copy()
+        mapTable[1, 1] = 0 # two detectors on spectrum 0, none on spectrum 1
+        self._assertRejected(mapTable)
+
+    def testBanksMustKeepToTheirSpectra(self):
+        mapTable = self.mapTable.copy()
+        mapTable[[2, 3], 1] = [3, 2] # swaps a detector of bank 0 into the spectra of bank 1
+        self._assertRejected(mapTable)
+
+
+class CacheFolderTest(SyntheticRunsTestBase):
+
+    def testBatchesShareDefaultCache(self):
+        cwd = os.getcwd()
+        os.chdir(self.folder)
+        try:
+            for outFolder in ("out1", "out2"):
+                converter = ConvertLOKIRuns.ConvertLokiRuns(self.runFolder, self.coordinateFile, self.idf,
+                                                            self.mapFile, outFolder, backend="h5py")
+                self.assertEqual(converter.cache.folder, FileCache.defaultFolder)
+                converter._loadRunInvariants()
+        finally:
+            os.chdir(cwd)
+        # the tables parsed for the first batch are found by the second
+        tables = [name for name in os.listdir(os.path.join(self.folder, FileCache.defaultFolder))
+                  if name.startswith("tables")]
+        self.assertEqual(len(tables), 1)
+        self.assertFalse(os.path.exists(os.path.join(self.folder, "out1", FileCache.defaultFolder)))
+
+
+class BankRoutingTest(SyntheticRunsTestBase):
+    banks = 3
+
+    def _checkRouting(self, converter):
+        converter._loadRunInvariants()
+        runs = converter._listRuns()
+        self.assertEqual([os.path.basename(run) for run in runs], ["run0_bank0.toff", "run1_bank0.toff",
+                                                                   "run2_bank0.toff"])
+        mapTable = self._mapTable()
+        bankSize = (len(mapTable) - 1) // self.banks
+        for run in runs:
+            tof, counts = converter._loadTofData(run)
+            bankCounts = [TofReader.TofReader(f).load()[2] for f in converter.runFiles[run]]
+            self.assertEqual(counts.shape[0], len(mapTable))
+            for physicalId, spectrum in mapTable:
+                bank = min(spectrum // bankSize, self.banks - 1) # the monitor is read from bank 0
+                expected = bankCounts[0 if spectrum == len(mapTable) - 1 else bank][physicalId]
+                numpy.testing.assert_array_equal(counts[spectrum], expected)
+
+    def testBanksAreRoutedIntoTheirSpectra(self):
+        self._checkRouting(self._converter(compactCounts=False))
+        self._checkRouting(self._converter())
+
+    def testBanksParsedInThreads(self):
+        converter = self._converter()
+        converter._bankThreads = lambda numFiles: numFiles
+        self._checkRouting(converter)
+
+    def testRunWithMissingBankIsRejected(self):
+        os.remove(os.path.join(self.runFolder, "run1_bank2.toff"))
+        converter = self._converter()
+        converter._loadRunInvariants()
+        index = converter._indexRuns(converter._listRuns())
+        self.assertEqual([os.path.basename(run) for run in index.scheduled()], ["run0_bank0.toff", "run2_bank0.toff"])
+        self.assertEqual([os.path.basename(run) for run in index.problems], ["run1_bank0.toff"])
+
+
+class SingleBankRunsTest(SyntheticRunsTestBase):
+
+    def testBankLikeNamesAreRunsOfTheirOwn(self):
+        for name in ("x_bank0.toff", "x_bank3.toff"):
+            shutil.copy(os.path.join(self.runFolder, "run0.toff"), os.path.join(self.runFolder, name))
+        converter = self._converter()
+        converter.convert()
+        self.assertEqual(sorted(f for f in os.listdir(self.outFolder) if f.endswith(".nxs")),
+                         ["run0.nxs", "run1.nxs", "run2.nxs", "x_bank0.nxs", "x_bank3.nxs"])
+
+
+class RunCacheTest(SyntheticRunsTestBase):
+
+    def _loadAll(self, converter):
+        converter._loadRunInvariants()
+        return [converter._loadTofData(run) for run in converter._listRuns()]
+
+    def _assertSameRuns(self, runs, expected):
+        self.assertEqual(len(runs), len(expected))
+        for (tof, counts), (expectedTof, expectedCounts) in zip(runs, expected):
+            numpy.testing.assert_array_equal(tof, expectedTof)
+            numpy.testing.assert_array_equal(CompactCounts.expand(counts), CompactCounts.expand(expectedCounts))
+
+    def _failParsing(self, *args):
+        self.fail("A cached run was parsed again")
+
+    def testCacheHitMatchesParse(self):
+        cacheFolder = os.path.join(self.folder, "cache")
+        for compactCounts in (True, False):
+            expected = self._loadAll(self._converter(compactCounts=compactCounts))
+            # the first load parses and caches the runs, the second maps them from the cache
+            self._assertSameRuns(self._loadAll(self._converter(runCache=True, cacheFolder=cacheFolder,
+                                                               compactCounts=compactCounts)), expected)
+            load = TofReader.TofReader.load
+            TofReader.TofReader.load = self._failParsing
+            try:
+                self._assertSameRuns(self._loadAll(self._converter(runCache=True, cacheFolder=cacheFolder,
+                                                                   compactCounts=compactCounts)), expected)
+            finally:
+                TofReader.TofReader.load = load
+            shutil.rmtree(cacheFolder)
+
+
+class SumRunsTest(SyntheticRunsTestBase):
+
+    def _runCounts(self):
+        converter = self._converter(compactCounts=False)
+        converter._loadRunInvariants()
+        return dict((os.path.basename(run), converter._loadTofData(run)) for run in converter._listRuns())
+
+    def _summed(self, name):
+        with h5py.File(os.path.join(self.outFolder, name + ".nxs"), "r") as f:
+            return f["mantid_workspace_1/workspace/axis1"][...], f["mantid_workspace_1/workspace/values"][...]
+
+    @unittest.skipIf(h5py is None, "h5py is not available")
+    def testSumEqualsSumOfRuns(self):
+        runs = self._runCounts()
+        for compactCounts in (True, False):
+            self._converter(compactCounts=compactCounts).sumRuns()
+            tof, values = self._summed("summed")
+            numpy.testing.assert_array_equal(tof, runs["run0.toff"][0])
+            numpy.testing.assert_allclose(values, sum(counts for tof, counts in runs.values()))
+
+    @unittest.skipIf(h5py is None, "h5py is not available")
+    def testGroupsSummedSeparately(self):
+        runs = self._runCounts()
+        self._converter().sumRuns(r"^(run)[02]$")
+        self.assertEqual(sorted(f for f in os.listdir(self.outFolder) if f.endswith(".nxs")), ["run.nxs"])
+        numpy.testing.assert_allclose(self._summed("run")[1], runs["run0.toff"][1] + runs["run2.toff"][1])
+
+
+class IncrementalConversionTest(SyntheticRunsTestBase):
+
+    def _convert(self):
+        '''
+        :return: The runs converted
+        '''
+        converted = []
+        converter = self._converter()
+        convertRuns = converter._convertRuns
+        converter._convertRuns = lambda infiles: (converted.extend(os.path.basename(f) for f in infiles),
+                                                  convertRuns(infiles))
+        converter.convert()
+        return converted
+
+    @unittest.skipIf(h5py is None, "h5py is not available")
+    def testOnlyChangedRunsConverted(self):
+        self.assertEqual(self._convert(), ["run0.toff", "run1.toff", "run2.toff"])
+        self.assertEqual(self._convert(), [])
+
+        # touched but unchanged, then changed
+        run1 = os.path.join(self.runFolder, "run1.toff")
+        os.utime(run1, (1e9, 1e9))
+        self.assertEqual(self._convert(), [])
+        with open(run1, "a") as f:
+            f.write("\n")
+        self.assertEqual(self._convert(), ["run1.toff"])
+        os.remove(os.path.join(self.outFolder, "run2.nxs"))
+        self.assertEqual(self._convert(), ["run2.toff"])
+
+
+class PrefetchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.converter = ConvertLOKIRuns.ConvertLokiRuns("data", "coordinate.txt", "idf.xml", cacheFolder=None,
+                                                         prefetch=2)
+        self.loaded = []
+        self.converter._tryLoadTofData = self._load
+
+    def _load(self, infile):
+        self.loaded.append(infile)
+        return infile, infile.upper(), None
+
+    def _readers(self):
+        return [thread for thread in threading.enumerate() if thread.name == "toffReader"]
+
+    def testResultsInFileOrder(self):
+        infiles = ["run" + str(i) for i in xrange(10)]
+        results = list(self.converter._loadRuns(infiles))
+        self.assertEqual(results, [(infile, infile.upper(), None) for infile in infiles])
+        self.assertEqual(self._readers(), [])
+
+    def testConsumerStoppingEarly(self):
+        infiles = ["run" + str(i) for i in xrange(100)]
+        results = self.converter._loadRuns(infiles)
+        self.assertEqual(next(results), ("run0", "RUN0", None))
+        results.close()
+        self.assertEqual(self._readers(), [])
+        # the reader stops within the queue depth of the run which was taken
+        self.assertLessEqual(len(self.loaded), 1 + 2 + 2)
+
+
+class PrefetchConversionTest(SyntheticRunsTestBase):
+
+    def _values(self, prefetch):
+        self._converter(prefetch=prefetch, force=True).convert()
+        values = {}
+        for name in sorted(os.listdir(self.outFolder)):
+            if name.endswith(".nxs"):
+                with h5py.File(os.path.join(self.outFolder, name), "r") as f:
+                    values[name] = f["mantid_workspace_1/workspace/values"][...]
+        return values
+
+    @unittest.skipIf(h5py is None, "h5py is not available")
+    def testPrefetchedConversionMatches(self):
+        expected = self._values(0)
+        values = self._values(2)
+        self.assertEqual(sorted(values), ["run0.nxs", "run1.nxs", "run2.nxs"])
+        for name in expected:
+            numpy.testing.assert_array_equal(values[name], expected[name])
+
+
+class WorkerProfilingTest(SyntheticRunsTestBase):
+
+    def setUp(self):
+        SyntheticRunsTestBase.setUp(self)
+        self.profiler = Profiling.profiler
+        Profiling.profiler = Profiling.StageProfiler()
+        Profiling.profiler.enable("parseToff")
+
+    def tearDown(self):
+        Profiling.profiler = self.profiler
+        SyntheticRunsTestBase.tearDown(self)
+
+    @unittest.skipIf(h5py is None, "h5py is not available")
+    def testStageProfiledInWorkers(self):
+        self._converter(workers=2).convert()
+        report = os.path.join(self.folder, "profile.json")
+        Profiling.profiler.writeReport(report)
+        stats = pstats.Stats(report + ".parseToff.prof")
+        loads = [calls[1] for (file, line, name), calls in stats.stats.items()
+                 if name == "load" and file.endswith("TofReader.py")]
+        self.assertEqual(loads, [3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import unittest
+import numpy
+import ExtractGeometry
+
+mainPath = os.path.dirname(os.path.realpath(__file__))
+
+
+class ExtractGeometryTest(unittest.TestCase):
+    '''
+    Compares the components extracted from coordinate.txt with testdata/coordinate_components.npz, which holds the
+    components and position offset found by the row grouping of GeometryExtractor before it was vectorised. The rows
+    of all components are flattened as in the geometry cache.
+    '''
+
+    def setUp(self):
+        self.extractor = ExtractGeometry.GeometryExtractor(os.path.join(mainPath, "coordinate.txt"))
+        self.extractor.extract()
+        self.reference = numpy.load(os.path.join(mainPath, "testdata", "coordinate_components.npz"))
+
+    def _referenceComponents(self):
+        rowX = numpy.split(self.reference["rowX"], numpy.cumsum(self.reference["rowXLengths"])[:-1])
+        rowIds = numpy.split(self.reference["rowIds"], numpy.cumsum(self.reference["rowIdLengths"])[:-1])
+        components = [[] for i in xrange(self.reference["rowComponent"].max() + 1)]
+        for comp, y, xvals, ids in zip(self.reference["rowComponent"], self.reference["rowY"], rowX, rowIds):
+            components[comp].append((y, xvals, ids))
+        return components
+
+    def testComponentsMatchReference(self):
+        reference = self._referenceComponents()
+        self.assertEqual(self.extractor.getNumComponents(), len(reference))
+        for i, referenceComp in enumerate(reference):
+            comp = self.extractor.getComponent(i)
+            self.assertEqual(len(comp), len(referenceComp))
+            for (y, xvals, ids), (refY, refX, refIds) in zip(comp, referenceComp):
+                self.assertEqual(y, refY)
+                numpy.testing.assert_array_equal(xvals, refX)
+                numpy.testing.assert_array_equal(ids, refIds)
+
+    def testPosOffsetMatchesReference(self):
+        self.assertEqual(self.extractor.getPosOffset(), self.reference["posOffset"][()])
+
+
+
+class PadShapeTest(unittest.TestCase):
+    '''
+    Pads with hand-computed areas, centroids and solid angles, with their corners in mm in no particular order as in
+    coordinate.txt.
+    '''
+
+    def setUp(self):
+        self.extractor = ExtractGeometry.GeometryExtractor("coordinate.txt")
+
+    def _setPads(self, corners):
+        self.extractor.x = numpy.array([[x for x, y in pad] for pad in corners], dtype=float)
+        self.extractor.y = numpy.array([[y for x, y in pad] for pad in corners], dtype=float)
+        self.extractor._computePadShapes()
+
+    def testTrapezoid(self):
+        # bases of 4 and 2 mm, 2 mm apart
+        self._setPads([[(3, 2), (0, 0), (1, 2), (4, 0)]])
+        numpy.testing.assert_allclose(self.extractor.areas, [6.0])
+        numpy.testing.assert_allclose(self.extractor.centroidX, [2.0])
+        numpy.testing.assert_allclose(self.extractor.centroidY, [2 * (4 + 2 * 2) / (3.0 * (4 + 2))])
+
+    def testSolidAngles(self):
+        distance = 2.0
+        def cornerOnBeam(a, b):
+            # solid angle of an a by b rectangle normal to the beam with a corner on it
+            return numpy.arcsin(a * b / numpy.sqrt((a * a + distance * distance) * (b * b + distance * distance)))
+
+        # a 1 m square centred on the beam, and a 0.5 by 0.3 m rectangle with a corner on the beam once shifted by 0.1 m
+        self._setPads([[(500, 500), (-500, -500), (-500, 500), (500, -500)],
+                       [(0, -100), (500, 200), (0, 200), (500, -100)]])
+        numpy.testing.assert_allclose(self.extractor.areas, [1e6, 1.5e5])
+        numpy.testing.assert_allclose(self.extractor.solidAngles(distance, 0.0)[0], 4 * cornerOnBeam(0.5, 0.5))
+        numpy.testing.assert_allclose(self.extractor.solidAngles(distance, 0.1)[1], cornerOnBeam(0.5, 0.3))
+
+
+if __name__ == "__main__":
+    unittest.main()
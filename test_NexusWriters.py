@@ -0,0 +1,130 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+import CompactCounts
+import GenerateIDF
+import NexusWriters
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+try:
+    from mantid.simpleapi import LoadNexusProcessed, mtd
+except ImportError:
+    LoadNexusProcessed = None
+
+mainPath = os.path.dirname(os.path.realpath(__file__))
+
+
+class NexusWriterTestBase(unittest.TestCase):
+    '''
+    Generates the IDF of coordinate.txt and a synthetic run with a spectrum for every detector of the IDF.
+    '''
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        os.chdir(self.folder)
+        try:
+            generator = GenerateIDF.LOKIGenerator(os.path.join(mainPath, "coordinate.txt"))
+            generator.generate()
+            numSpectra = sum(xpixels * ypixels for xpixels, ypixels in generator._panelSizes()) + 1
+        finally:
+            os.chdir(cwd)
+        self.idf = os.path.join(self.folder, "LOKI_BANDGEM_definition.xml")
+
+        random = numpy.random.RandomState(0)
+        self.tof = 1.0 + 0.01 * numpy.arange(20)
+        self.counts = random.poisson(0.2, (numSpectra, len(self.tof))).astype(float)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+
+@unittest.skipIf(h5py is None, "h5py is not available")
+class H5pyWriterTest(NexusWriterTestBase):
+
+    def _write(self, counts, name):
+        outfile = os.path.join(self.folder, name + ".nxs")
+        NexusWriters.H5pyWriter(self.idf, chunkSpectra=100).write(name, self.tof, counts, outfile)
+        return outfile
+
+    def _string(self, dataset):
+        self.assertEqual(dataset.shape, (1,))
+        return dataset[0]
+
+    def testLayout(self):
+        outfile = self._write(self.counts, "run")
+        numSpectra = self.counts.shape[0]
+        with h5py.File(outfile, "r") as f:
+            entry = f["mantid_workspace_1"]
+            self.assertEqual(entry.attrs["NX_class"], "NXentry")
+            self.assertEqual(self._string(entry["workspace_name"]), "run")
+            self.assertEqual(self._string(entry["definition"]), "Mantid Processed Workspace")
+
+            workspace = entry["workspace"]
+            self.assertEqual(workspace.attrs["NX_class"], "NXdata")
+            numpy.testing.assert_array_equal(workspace["values"][...], self.counts)
+            self.assertEqual(workspace["values"].attrs["signal"], 1)
+            self.assertEqual(workspace["values"].attrs["axes"], "axis2,axis1")
+            numpy.testing.assert_array_equal(workspace["errors"][...], numpy.zeros(self.counts.shape))
+            numpy.testing.assert_array_equal(workspace["axis1"][...], self.tof)
+            numpy.testing.assert_array_equal(workspace["axis2"][...], numpy.arange(1, numSpectra + 1))
+
+            instrument = entry["instrument"]
+            self.assertEqual(self._string(instrument["name"]), "LOKI")
+            with open(self.idf, "r") as idf:
+                self.assertEqual(self._string(instrument["instrument_xml/data"]), idf.read())
+            detector = instrument["detector"]
+            numpy.testing.assert_array_equal(detector["detector_list"][...], numpy.arange(numSpectra))
+            numpy.testing.assert_array_equal(detector["detector_index"][...], numpy.arange(numSpectra))
+            numpy.testing.assert_array_equal(detector["detector_count"][...], numpy.ones(numSpectra))
+            numpy.testing.assert_array_equal(detector["spectra"][...], numpy.arange(1, numSpectra + 1))
+
+    def testCompactCountsWriteTheSameValues(self):
+        compact = CompactCounts.compact(self.counts)
+        self.assertIsInstance(compact, CompactCounts.SparseCounts)
+        outfiles = [self._write(counts, name) for counts, name in
+                    [(self.counts, "dense"), (compact, "sparse"), (self.counts.astype(numpy.uint8), "narrow")]]
+        for outfile in outfiles:
+            with h5py.File(outfile, "r") as f:
+                values = f["mantid_workspace_1/workspace/values"]
+                self.assertEqual(values.dtype, float)
+                numpy.testing.assert_array_equal(values[...], self.counts)
+
+
+@unittest.skipIf(LoadNexusProcessed is None or h5py is None, "mantid and h5py are needed to compare the backends")
+class BackendComparisonTest(NexusWriterTestBase):
+    '''
+    Writes the same run with both backends and checks that Mantid loads equivalent workspaces from the two files.
+    '''
+
+    def _load(self, writer, name):
+        outfile = os.path.join(self.folder, name + ".nxs")
+        writer.write(name, self.tof, self.counts, outfile)
+        return LoadNexusProcessed(outfile, OutputWorkspace=name + "_loaded")
+
+    def testLoadedWorkspacesMatch(self):
+        fromMantid = self._load(NexusWriters.MantidWriter(self.idf), "mantid")
+        fromH5py = self._load(NexusWriters.H5pyWriter(self.idf), "h5py")
+        try:
+            self.assertEqual(fromH5py.getNumberHistograms(), fromMantid.getNumberHistograms())
+            self.assertEqual(fromH5py.getInstrument().getName(), fromMantid.getInstrument().getName())
+            self.assertEqual(fromH5py.getAxis(0).getUnit().unitID(), fromMantid.getAxis(0).getUnit().unitID())
+            numpy.testing.assert_array_equal(fromH5py.extractX(), fromMantid.extractX())
+            numpy.testing.assert_array_equal(fromH5py.extractY(), fromMantid.extractY())
+            numpy.testing.assert_array_equal(fromH5py.extractE(), fromMantid.extractE())
+            for i in xrange(fromMantid.getNumberHistograms()):
+                self.assertEqual(fromH5py.getSpectrum(i).getSpectrumNo(), fromMantid.getSpectrum(i).getSpectrumNo())
+                self.assertEqual(set(fromH5py.getSpectrum(i).getDetectorIDs()),
+                                 set(fromMantid.getSpectrum(i).getDetectorIDs()))
+        finally:
+            mtd.clear()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import pstats
+import shutil
+import tempfile
+import unittest
+import Profiling
+
+
+def _work(n):
+    return sum(xrange(n))
+
+
+class StageProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.report = os.path.join(self.folder, "report.json")
+        self.profiler = Profiling.StageProfiler()
+        self.profiler.enable("work")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _calls(self):
+        stats = pstats.Stats(self.report + ".work.prof")
+        return [calls[1] for (file, line, name), calls in stats.stats.items() if name == "_work"]
+
+    def testStatsMergedFromWorkers(self):
+        with self.profiler.stage("work"):
+            _work(10)
+        # a worker is a copy of the profiler which passes back its statistics as the pool workers do
+        worker = Profiling.StageProfiler()
+        worker.enable("work")
+        for n in (10, 20):
+            with worker.stage("work"):
+                _work(n)
+        self.profiler.addStats(worker.popStats())
+        self.assertIsNone(worker.popStats())
+
+        self.profiler.writeReport(self.report)
+        self.assertEqual(self._calls(), [3])
+
+    def testOnlyWorkersRanStage(self):
+        worker = Profiling.StageProfiler()
+        worker.enable("work")
+        with worker.stage("work"):
+            _work(10)
+        self.profiler.addStats(worker.popStats())
+        self.profiler.writeReport(self.report)
+        self.assertEqual(self._calls(), [1])
+
+    def testNothingDumpedIfStageNeverRan(self):
+        with self.profiler.stage("other"):
+            _work(10)
+        self.profiler.writeReport(self.report)
+        self.assertTrue(os.path.exists(self.report))
+        self.assertFalse(os.path.exists(self.report + ".work.prof"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+import numpy
+import Rebinning
+
+
+class RebinnerTest(unittest.TestCase):
+
+    def setUp(self):
+        random = numpy.random.RandomState(0)
+        # bin centres 10 to 200 microseconds, so the bins run from 5 to 205
+        self.tof = 10.0 * numpy.arange(1, 21)
+        self.counts = random.poisson(5.0, (4, 20)).astype(float)
+
+    def testParseParams(self):
+        self.assertEqual(Rebinning.parseParams("1000,-0.01,60000"), [1000.0, -0.01, 60000.0])
+
+    def testLinearEdges(self):
+        numpy.testing.assert_allclose(Rebinning.Rebinner([0, 25, 100]).edges, [0, 25, 50, 75, 100])
+        # the last bin is narrower where dx does not divide the range
+        numpy.testing.assert_allclose(Rebinning.Rebinner([0, 30, 100]).edges, [0, 30, 60, 90, 100])
+        numpy.testing.assert_allclose(Rebinning.Rebinner([0, 50, 100, 10, 120]).edges, [0, 50, 100, 110, 120])
+
+    def testLogEdges(self):
+        numpy.testing.assert_allclose(Rebinning.Rebinner([1, -1, 8]).edges, [1, 2, 4, 8])
+        numpy.testing.assert_allclose(Rebinning.Rebinner([1, -1, 10]).edges, [1, 2, 4, 8, 10])
+
+    def testInvalidParams(self):
+        for params in ([0, 10], [0, 10, 100, 5], [100, 10, 0], [0, 0, 100], [0, -0.1, 100]):
+            self.assertRaises(ValueError, Rebinning.Rebinner, params)
+
+    def testCountsConserved(self):
+        for params in ([5, 7, 205], [5, -0.1, 205], [0, 13, 300]):
+            edges, counts = Rebinning.Rebinner(params).rebin(self.tof, self.counts)
+            self.assertEqual(counts.shape, (4, len(edges) - 1))
+            numpy.testing.assert_allclose(counts.sum(axis=1), self.counts.sum(axis=1))
+
+    def testCountsOutsideRangeDropped(self):
+        # the new range holds the bins centred on 10 to 100 and half of the bin centred on 110
+        edges, counts = Rebinning.Rebinner([5, 10, 110]).rebin(self.tof, self.counts)
+        numpy.testing.assert_allclose(counts.sum(axis=1), self.counts[:, :10].sum(axis=1) + self.counts[:, 10] / 2)
+
+    def testMatchingEdgesKeepCounts(self):
+        edges, counts = Rebinning.Rebinner([5, 10, 205]).rebin(self.tof, self.counts)
+        numpy.testing.assert_allclose(counts, self.counts)
+
+    def testRangeMissingRunRejected(self):
+        # e.g. parameters in nanoseconds for an axis in microseconds
+        for params in ([1000, 10, 5000], [0, 1, 5]):
+            self.assertRaises(ValueError, Rebinning.Rebinner(params).rebin, self.tof, self.counts)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+import Benchmark
+import GenerateIDF
+import RegionIntegration
+
+
+class RegionIntegratorTest(unittest.TestCase):
+    '''
+    Region weights over a small synthetic layout of two banks.
+    '''
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        data = Benchmark.SyntheticData(self.folder, components=2, rowsPerComponent=3, padsPerRow=4, dummies=5)
+        self.coordinateFile = data.writeCoordinates()
+        cwd = os.getcwd()
+        os.chdir(self.folder)
+        try:
+            GenerateIDF.LOKIGenerator(self.coordinateFile, 2).generate()
+        finally:
+            os.chdir(cwd)
+        self.mapFile = os.path.join(self.folder, "LOKI_map.csv")
+        self.pixels = numpy.load(os.path.join(self.folder, "LOKI_pixels.npy"))
+        self.padIDs = self.pixels["id"][self.pixels["physicalId"] >= 0]
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _integrator(self, regions):
+        regionFile = os.path.join(self.folder, "regions.json")
+        with open(regionFile, "w") as f:
+            json.dump(regions, f)
+        integrator = RegionIntegration.RegionIntegrator(regionFile, self.coordinateFile, self.mapFile)
+        integrator.load()
+        return integrator
+
+    def _weights(self, integrator):
+        '''
+        :return: Dense weights with a row per region and a column per IDF detector ID
+        '''
+        weights = numpy.zeros((len(integrator.names), len(self.pixels)))
+        for region, (start, stop) in enumerate(zip(integrator.indptr[:-1], integrator.indptr[1:])):
+            weights[region, integrator.columns[start:stop]] = integrator.weights[start:stop]
+        return weights
+
+    def testFullCoverageRectangle(self):
+        integrator = self._integrator([{"name": "all", "shape": "rectangle", "x": [-100, 100], "y": [-100, 100]}])
+        self.assertEqual(integrator.names, ["all"])
+        self.assertEqual(sorted(integrator.columns), sorted(self.padIDs))
+        numpy.testing.assert_allclose(integrator.weights, 1.0)
+
+        counts = numpy.random.RandomState(0).poisson(2.0, (len(self.pixels), 7)).astype(float)
+        numpy.testing.assert_allclose(integrator.integrate(counts), counts[self.padIDs].sum(axis=0)[numpy.newaxis])
+
+    def testComplementarySectors(self):
+        for start, stop in ((0, 137), (170, -10)):
+            integrator = self._integrator([
+                {"shape": "sector", "centre": [0, 0], "radii": [0, 100], "angles": [start, stop]},
+                {"shape": "sector", "centre": [0, 0], "radii": [0, 100], "angles": [stop, start]}])
+            self.assertEqual(integrator.names, ["region0", "region1"])
+            weights = self._weights(integrator)
+            numpy.testing.assert_allclose(weights.sum(axis=0)[self.padIDs], 1.0)
+            # the boundaries cross pads, which are then shared between the sectors
+            self.assertTrue(((weights > 0) & (weights < 1)).any())
+
+    def testComplementaryAnnuli(self):
+        radius = numpy.sqrt(self.pixels["x"] ** 2 + self.pixels["y"] ** 2)[self.padIDs].mean()
+        integrator = self._integrator([{"shape": "annulus", "centre": [0, 0], "radii": [0, radius]},
+                                       {"shape": "annulus", "centre": [0, 0], "radii": [radius, 100]}])
+        weights = self._weights(integrator)
+        numpy.testing.assert_allclose(weights.sum(axis=0)[self.padIDs], 1.0)
+        self.assertTrue(((weights > 0) & (weights < 1)).any())
+
+    def testInvalidRegions(self):
+        self.assertRaises(ValueError, self._integrator, [{"shape": "circle"}])
+        self.assertRaises(ValueError, self._integrator, [{"shape": "sector", "centre": [0, 0], "radii": [0, 1]}])
+
+
+if __name__ == "__main__":
+    unittest.main()
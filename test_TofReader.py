@@ -0,0 +1,107 @@
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+import TofReader
+
+
+def _loadWithCsv(filename):
+    '''
+    Parses a *.toff file with the csv module as ConvertLokiRuns did before TofReader.
+    :return: TOF values, the detector ID column and the counts
+    '''
+    with open(filename, "rb") as f:
+        contents = list(csv.reader(f, delimiter='\t'))
+    tof = contents[0]
+    del contents[0]
+    del tof[0] # column 0 is the detector id
+    del tof[-1] # the last column contains nothing.
+    ids = numpy.array([line[0] for line in contents]).astype(int)
+    counts = numpy.array([line[1:-1] for line in contents]).astype(float)
+    return numpy.array(tof).astype(float) / 1000.0, ids, counts
+
+
+class TofReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        random = numpy.random.RandomState(0)
+        self.tof = 1000 + 12.5 * numpy.arange(50)
+        self.counts = random.poisson(3.0, (40, 50)).astype(float)
+        self.counts[5, 7] = 2.5 # counts are not always whole numbers
+        self.filename = os.path.join(self.folder, "run.toff")
+        with open(self.filename, "w") as f:
+            f.write(self._contents())
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _contents(self):
+        lines = ["ID\t" + "\t".join(repr(t) for t in self.tof) + "\t\n"]
+        for id, row in enumerate(self.counts):
+            lines.append(str(id) + "\t" + "\t".join(repr(c) for c in row) + "\t\n")
+        return "".join(lines)
+
+    def testLoadMatchesCsvParser(self):
+        tof, ids, counts = TofReader.TofReader(self.filename).load()
+        csvTof, csvIds, csvCounts = _loadWithCsv(self.filename)
+        numpy.testing.assert_array_equal(tof, csvTof)
+        numpy.testing.assert_array_equal(ids, csvIds)
+        numpy.testing.assert_array_equal(counts, csvCounts)
+
+    def testLoadInSmallBlocks(self):
+        reader = TofReader.TofReader(self.filename)
+        reader.blockBytes = 100 # many blocks, each completed to a whole row
+        for numRows in (None, 40):
+            tof, ids, counts = reader.load(numRows)
+            numpy.testing.assert_array_equal(ids, numpy.arange(40))
+            numpy.testing.assert_array_equal(counts, self.counts)
+
+    def testLoadCompact(self):
+        reader = TofReader.TofReader(self.filename)
+        reader.blockBytes = 100
+        for numRows in (None, 40):
+            tof, ids, counts = reader.load(numRows, compact=True)
+            numpy.testing.assert_array_equal(ids, numpy.arange(40))
+            # the fractional count in row 5 leaves the counts as floats
+            self.assertEqual(counts.dtype, float)
+            numpy.testing.assert_array_equal(counts, self.counts)
+
+        self.counts[5, 7] = 2
+        with open(self.filename, "w") as f:
+            f.write(self._contents())
+        tof, ids, counts = reader.load(40, compact=True)
+        self.assertEqual(counts.dtype, numpy.uint8)
+        numpy.testing.assert_array_equal(counts, self.counts)
+
+    def testLoadRejectsWrongRowCount(self):
+        reader = TofReader.TofReader(self.filename)
+        self.assertRaises(ValueError, reader.load, 39)
+        self.assertRaises(ValueError, reader.load, 41)
+
+    def testLoadWithScannedRows(self):
+        reader = TofReader.TofReader(self.filename)
+        tof, numRows, numColumns = reader.scan()
+        self.assertEqual(numRows, 40)
+        self.assertEqual(numColumns, 52)
+        numpy.testing.assert_array_equal(reader.load(numRows)[2], self.counts)
+
+    def testScanIgnoresTrailingBlankLines(self):
+        reader = TofReader.TofReader(self.filename)
+        for ending in ["\n", "\n\n", "\r\n", " \t\n\n"]:
+            with open(self.filename, "w") as f:
+                f.write(self._contents() + ending)
+            numRows = reader.scan()[1]
+            self.assertEqual(numRows, 40)
+            numpy.testing.assert_array_equal(reader.load(numRows)[2], self.counts)
+
+    def testScanCountsLastRowWithoutNewline(self):
+        with open(self.filename, "w") as f:
+            f.write(self._contents()[:-1])
+        self.assertEqual(TofReader.TofReader(self.filename).scan()[1], 40)
+
+
+if __name__ == "__main__":
+    unittest.main()